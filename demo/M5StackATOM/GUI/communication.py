@@ -4,6 +4,46 @@ import serial
 from serial.tools import list_ports
 import time
 import json
+import struct
+import threading
+import atexit
+from concurrent.futures import Future
+
+# Binary frame of the device (see main.py of the device)
+# SYNC, length of the payload (2 bytes), command, id, payload, CRC16 (2 bytes)
+_SYNC = 0xa5
+_CMD_HELLO = 0x01
+_CMD_RECORD = 0x10
+_CMD_DECODE = 0x11
+_CMD_SEND = 0x20
+_CMD_ENCODE = 0x21
+_CMD_SEND_ID = 0x22
+_CMD_UPLOAD = 0x23
+_CMD_DELETE = 0x24
+_CMD_LIST = 0x25
+_CMD_TEXT = 0x30
+_CMD_EXIT = 0x7f
+_REPLY = 0x80
+# Commands run one by one on the receiver of the device
+_RX_COMMANDS = (_CMD_RECORD, _CMD_DECODE, _CMD_TEXT)
+_ST_OK = 0
+_PROTOCOLS = ('NEC', 'AEHA', 'SIRC12', 'SIRC15', 'SIRC20', 'RC5', 'RC6')
+
+def _crc16(data: bytes, crc: int=0xffff) -> int:
+    """CRC16-CCITT (0x1021)"""
+    for b in data:
+        crc ^= b << 8
+        for i in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        crc &= 0xffff
+    return(crc)
+
+def _pack(signal: list) -> bytes:
+    """Durations -> 3 bytes each (little endian)"""
+    return(b''.join([d.to_bytes(3, 'little') for d in signal]))
+
+def _unpack(data: bytes) -> list:
+    return([int.from_bytes(data[i:i+3], 'little') for i in range(0, len(data) - 2, 3)])
 
 class Communication():
     """Class to communicate with the device
@@ -23,6 +63,9 @@ class Communication():
     # _DEFAULT_VID = 11914
     # _DEFAULT_PID = 5
 
+    # Binary protocol version of this class
+    VERSION = 2
+
     def __init__(self, device_name: str='', vid: int=0, pid: int=0):
         """Initialize
         
@@ -38,11 +81,20 @@ class Communication():
             Product ID of USB device If 0, the default value _DEFAULT_PID is applied.
             If the device_name parameter is not an empty string, it does not apply.
         """
-        if device_name:
-            self._device = device_name
-        else:
-            self._device = None
-            self.connect('', vid, pid)
+        self._device = None
+        self._binary = False
+        self._version = 0
+        self._capabilities = 0
+        # Link of the binary protocol
+        self._serial = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._seq = 1
+        self._slots = threading.BoundedSemaphore(1)
+        # Return the device to the text protocol when the application ends
+        atexit.register(self._close)
+        self.connect(device_name, vid, pid)
 
     def connect(self, device_name: str='', vid: int= 0, pid: int = 0) -> bool:
         """Connection
@@ -50,6 +102,8 @@ class Communication():
         Disable the currently connected device and connect to the new device.
         The device is active only at the moment of sending and receiving data.
         Therefore, it is not necessary to connect after disconnecting.
+        The binary protocol is used if the device replies to the handshake.
+        Then the connection stays open, and several requests can be outstanding.
 
         Parameters
         ----------
@@ -63,8 +117,11 @@ class Communication():
             Product ID of USB device If 0, the default value _DEFAULT_PID is applied.
             If the device_name parameter is not an empty string, it does not apply.
         """
+        self._close()
+        self._binary = False
         if device_name:
             self._device = device_name
+            self._handshake()
             return(True)
         devlis = list_ports.comports()
         if vid <= 0 or pid <= 0:
@@ -76,6 +133,7 @@ class Communication():
         for i in devlis:
             if i.vid == _vid and i.pid == _pid:
                 self._device = i.device
+                self._handshake()
                 return(True)
         self._device = None
         return(False)
@@ -85,7 +143,285 @@ class Communication():
         
         Disable the communication path.
         """
+        self._close()
         self._device = None
+        self._binary = False
+
+    def is_binary(self) -> bool:
+        """Whether the binary protocol is used
+
+        Returns
+        ----------
+        bool
+        """
+        return(self._binary)
+
+    def get_version(self) -> tuple:
+        """Binary protocol of the device
+
+        Returns
+        ----------
+        tuple (item1, item2)
+            item1: int
+                Version (0 for the text protocol only)
+            item2: int
+                Capabilities bits (1: record, 2: send, 4: store, 8: text)
+        """
+        return((self._version, self._capabilities))
+
+    def _handshake(self, timeout: float=1) -> None:
+        """Switch the device to the binary protocol
+
+        The device answers "v" with ["BIN", version, capabilities] and waits
+        for binary frames. A device already in the binary protocol ignores
+        the text, and an older device answers "NG".
+        """
+        self._binary = False
+        self._version = 0
+        self._capabilities = 0
+        try:
+            with serial.Serial(self._device, baudrate=115200, timeout=0.2,
+                               write_timeout=2) as ser:
+                ser.reset_input_buffer()
+                ser.reset_output_buffer()
+                ser.write(b'\r\nv\r\n')
+                start_time = time.time()
+                while time.time() - start_time < timeout:
+                    line = ser.readline()
+                    if b'NG' in line:
+                        return
+                    if b'BIN' in line:
+                        break
+                ser.timeout = timeout
+                ser.write(self._encode(_CMD_HELLO, 0, b''))
+                reply = self._read_frame(ser, timeout)
+            if reply and reply[0] == _CMD_HELLO | _REPLY and reply[2][0] == _ST_OK:
+                version, capabilities, size, pipeline = struct.unpack('<BHHB', reply[2][1:7])
+                if version == Communication.VERSION:
+                    self._version = version
+                    self._capabilities = capabilities
+                    self._slots = threading.BoundedSemaphore(pipeline)
+                    self._binary = True
+        except:
+            pass
+
+    def _encode(self, cmd: int, seq: int, payload: bytes) -> bytes:
+        """Binary frame of the request"""
+        head = struct.pack('<HBB', len(payload), cmd, seq)
+        crc = _crc16(payload, _crc16(head))
+        return(bytes((_SYNC,)) + head + payload + struct.pack('<H', crc))
+
+    def _read_frame(self, ser, timeout: float) -> tuple:
+        """Read a frame
+
+        Returns
+        ----------
+        tuple (command, id, payload), or None for no frame or a broken frame.
+        """
+        while True:
+            b = ser.read(1)
+            if not b:
+                return(None)
+            if b[0] == _SYNC:
+                break
+        end_time = time.time() + timeout
+        data = b''
+        size = 6    # length, command, id and CRC until the length is known
+        while len(data) < size:
+            if time.time() > end_time:
+                return(None)
+            data += ser.read(size - len(data))
+            if len(data) >= 4:
+                size = 6 + (data[0] | (data[1] << 8))
+        head = data[:4]
+        payload = data[4:-2]
+        if _crc16(payload, _crc16(head)) != data[-2] | (data[-1] << 8):
+            return(None)
+        return((head[2], head[3], payload))
+
+    def _open(self) -> None:
+        """Open the serial link and start the reader thread"""
+        if self._serial is None:
+            self._serial = serial.Serial(self._device, baudrate=115200, timeout=0.1,
+                                         write_timeout=2)
+            self._reader = threading.Thread(target=self._read_loop, daemon=True)
+            self._reader.start()
+
+    def _close(self) -> None:
+        """Close the serial link. The waiting requests fail.
+
+        The device is returned to the text protocol by _CMD_EXIT,
+        so the text commands and the REPL (Ctrl-C) work again.
+        """
+        with self._lock:
+            ser = self._serial
+            self._serial = None
+        if ser is not None:
+            if self._reader is not threading.current_thread():
+                self._reader.join()
+        if self._binary:
+            self._binary = False
+            self._exit(ser)
+        if ser is not None:
+            ser.close()
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        for cmd, future in pending.values():
+            self._slots.release()
+            future.set_exception(IOError())
+
+    def _exit(self, ser) -> None:
+        """Send _CMD_EXIT. The device replies after the running requests."""
+        frame = self._encode(_CMD_EXIT, 0, b'')
+        try:
+            if ser is None:
+                with serial.Serial(self._device, baudrate=115200, timeout=0.1,
+                                   write_timeout=2) as ser:
+                    ser.write(frame)
+                    ser.flush()
+            else:
+                ser.write(frame)
+                ser.flush()
+        except:
+            pass
+
+    def _read_loop(self) -> None:
+        """Reader thread: give the replies to the futures of the requests"""
+        ser = self._serial
+        while self._serial is ser:
+            try:
+                frame = self._read_frame(ser, 1)
+            except:
+                self._close()
+                return
+            if frame is None:
+                continue
+            cmd, seq, data = frame
+            with self._lock:
+                request = self._pending.pop(seq, None)
+            if request is None:
+                # The request has timed out
+                continue
+            self._slots.release()
+            if cmd != request[0] | _REPLY:
+                request[1].set_exception(IOError())
+            else:
+                request[1].set_result(self._ack(request[0], data))
+
+    def request(self, msg: str) -> Future:
+        """Send a command without waiting for the reply (binary protocol)
+
+        Several requests can be outstanding on the connection,
+        and the device may reply out of order.
+
+        Parameters
+        ----------
+        msg: str
+            Same as the text commands of send() and record().
+
+        Returns
+        ----------
+        concurrent.futures.Future
+            The result is the reply of the text command, "OK" / "NG" or the list.
+            Blocks while the device has no room for another request.
+
+        Raises
+        ----------
+        ValueError
+            msg is not a command. The link stays open.
+        IOError
+            The binary protocol is not used, or the link has failed.
+        """
+        if not self._binary:
+            raise IOError()
+        try:
+            cmd, payload = self._frame(msg)
+        except:
+            raise ValueError(msg)
+        self._slots.acquire()
+        future = Future()
+        try:
+            with self._lock:
+                self._open()
+                # id 0 is used by the handshake
+                seq = self._seq
+                while seq == 0 or seq in self._pending:
+                    seq = (seq + 1) & 0xff
+                self._seq = (seq + 1) & 0xff
+                future.seq = seq
+                future.ahead = 0
+                if cmd in _RX_COMMANDS:
+                    future.ahead = len([c for c, f in self._pending.values() if c in _RX_COMMANDS])
+                self._serial.write(self._encode(cmd, seq, payload))
+                # The reader thread waits for the lock, so the reply is not missed
+                self._pending[seq] = (cmd, future)
+        except:
+            self._slots.release()
+            raise
+        return(future)
+
+    def _result(self, future: Future, timeout: float):
+        """Reply of the request, or None for a communication error
+
+        The timeout is counted again for each request on the receiver ahead of it,
+        which the device runs first. A timeout fails only this request.
+        """
+        try:
+            return(future.result(timeout * (1 + future.ahead)))
+        except:
+            with self._lock:
+                if self._pending.pop(future.seq, None):
+                    self._slots.release()
+            return(None)
+
+    def _frame(self, msg: str) -> tuple:
+        """Text command -> (binary command, payload)"""
+        msg = msg.strip()
+        op = msg[0]
+        if op == 'w':
+            return((_CMD_SEND, _pack(json.loads(msg[1:]))))
+        elif op == 'e':
+            protocol, address, command, repeats = json.loads(msg[1:])
+            payload = struct.pack('<BHB', _PROTOCOLS.index(protocol), address, repeats)
+            if protocol == 'AEHA':
+                return((_CMD_ENCODE, payload + bytes(command)))
+            return((_CMD_ENCODE, payload + struct.pack('<H', command)))
+        elif op == 'r' or op == 'd':
+            wait, blank, size = json.loads(msg[1:])
+            return((_CMD_RECORD if op == 'r' else _CMD_DECODE, struct.pack('<IHH', wait, blank, size)))
+        elif op == 's':
+            return((_CMD_SEND_ID, struct.pack('<H', int(msg[1:]))))
+        elif op == 'u':
+            sig_id, signal = json.loads(msg[1:])
+            return((_CMD_UPLOAD, struct.pack('<H', sig_id) + _pack(signal)))
+        elif op == 'x':
+            return((_CMD_DELETE, struct.pack('<H', int(msg[1:]))))
+        elif op == 'l':
+            return((_CMD_LIST, b''))
+        # The others are sent as text
+        return((_CMD_TEXT, msg.encode()))
+
+    def _ack(self, cmd: int, data: bytes):
+        """Reply payload -> the reply of the text command"""
+        if data[0] != _ST_OK:
+            return([] if cmd in (_CMD_RECORD, _CMD_DECODE, _CMD_LIST) else 'NG')
+        data = data[1:]
+        if cmd == _CMD_RECORD:
+            return(_unpack(data))
+        elif cmd == _CMD_DECODE:
+            if data[0] == 0:
+                return(_unpack(data[1:]))
+            protocol, address, repeats = struct.unpack('<BHB', data[1:5])
+            protocol = _PROTOCOLS[protocol]
+            if protocol == 'AEHA':
+                return([protocol, address, list(data[5:]), repeats])
+            return([protocol, address, struct.unpack('<H', data[5:7])[0], repeats])
+        elif cmd == _CMD_LIST:
+            return([list(struct.unpack('<HH', data[i:i+4])) for i in range(0, len(data), 4)])
+        elif cmd == _CMD_TEXT:
+            return(json.loads(data) if data[:1] == b'[' else data.decode())
+        return('OK')
 
     def is_connect(self) -> bool:
         """Whether it is connected
@@ -107,6 +443,13 @@ class Communication():
         msg: str
             Data sent to the device. The format is
             "w[400, 1200, 400, ...]\r\n"
+            or the protocol code encoded on the device
+            "e[\"NEC\", 4, 8, 0]\r\n"
+                [protocol, address, command, repeats] (see UpyIrProtocol.py)
+            or the signal stored on the device (see UpyIrStore.py)
+            "s5\r\n"       send the signal of id 5
+            "u[5, [400, 1200, 400, ...]]\r\n"    store the signal as id 5
+            "x5\r\n"       delete the signal of id 5
         
         Returns
         ----------
@@ -116,6 +459,15 @@ class Communication():
         if not self.is_connect():
             return(False)
         try:
+            if self._binary:
+                # A timeout or a malformed command fails only this request,
+                # and the link stays open
+                try:
+                    future = self.request(msg)
+                except ValueError:
+                    return(False)
+                ack = self._result(future, timeout)
+                return(ack == 'OK')
             with serial.Serial(self._device, baudrate=115200, timeout=timeout,
                                write_timeout=2) as ser:
                 ser.reset_input_buffer()
@@ -169,6 +521,17 @@ class Communication():
         if not self.is_connect():
             return((False, []))
         try:
+            if self._binary:
+                # A timeout or a malformed command fails only this request,
+                # and the link stays open
+                try:
+                    future = self.request(msg)
+                except ValueError:
+                    return((False, []))
+                ack = self._result(future, timeout)
+                if ack is None:
+                    return((False, []))
+                return((True, ack))
             with serial.Serial(self._device, baudrate=115200, timeout=timeout,
                                write_timeout=2) as ser:
                 ser.reset_input_buffer()
@@ -193,3 +556,72 @@ class Communication():
         except:
             self.disconnect()
             return((False, []))
+
+    def decode(self, msg: str, timeout: float=4) -> tuple:
+        """Get infrared received signal decoded on the device
+
+        Parameters
+        ----------
+        msg: str
+            Data sent to the device. The format is
+            "d[4000, 200, 1023]\r\n"
+                The elements are the same as record().
+
+        Returns
+        ----------
+        tuple (item1, item2)
+            item1: bool
+                Communication error
+            item2: list
+                [protocol, address, command, repeats] for a known protocol.
+                    ex. ["NEC", 4, 8, 0]
+                    The command of "AEHA" is a list of data bytes.
+                Integer list meaning received signal for an unknown protocol.
+                If it fails, an empty list is returned.
+        """
+        return(self.record(msg, timeout))
+
+    def batch(self, msg: str, timeout: float=10) -> tuple:
+        """Send several infrared signals by the transmit queue of the device
+
+        The device sends the entries at their start time, so the host does not
+        wait for each of them.
+
+        Parameters
+        ----------
+        msg: str
+            Data sent to the device. The format is
+            "b[[signal, count, gap, priority, start, deadline], ...]\r\n"
+                signal is the time list or [protocol, address, command, repeats].
+                count is the number of frames, and gap is the space between them [usec].
+                The entry of the higher priority is sent first when several are due.
+                start and deadline are the time from the command [msec].
+                deadline=0 is none. The trailing elements can be omitted.
+            ex. "b[[[\"NEC\", 4, 8, 0]], [[\"NEC\", 4, 9, 0], 1, 0, 0, 2000]]\r\n"
+        timeout: float
+            Set it longer than the last start time.
+
+        Returns
+        ----------
+        tuple (item1, item2)
+            item1: bool
+                Communication error
+            item2: list
+                "OK", "NG" or "LATE" for each entry.
+                If it fails, an empty list is returned.
+        """
+        return(self.record(msg, timeout))
+
+    def signals(self, timeout: float=4) -> tuple:
+        """Get the list of the signals stored on the device
+
+        Returns
+        ----------
+        tuple (item1, item2)
+            item1: bool
+                Communication error
+            item2: list
+                [[id, number of durations], ...]
+                If it fails, an empty list is returned.
+        """
+        return(self.record('l\r\n', timeout))
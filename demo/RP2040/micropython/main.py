@@ -1,9 +1,24 @@
 from machine import Pin
 from micropython import const
 from gc import collect
+from array import array
+import micropython
 import json
+import select
+import struct
+import sys
+import uasyncio as asyncio
 from UpyIrTx import UpyIrTx
 from UpyIrRx import UpyIrRx
+from UpyIrProtocol import decode, encode
+try:
+    from UpyIrTxQueue import UpyIrTxQueue    # option: the 'b' command
+except ImportError:
+    UpyIrTxQueue = None
+try:
+    from UpyIrStore import UpyIrStore        # option: the stored signals
+except ImportError:
+    UpyIrStore = None
 
 # RP2040 RX=Pin18, TX=Pin19
 _GROVE_PIN = {'ATOM':  (32, 26),
@@ -20,37 +35,360 @@ _TX_FREQ = const(38000)
 _TX_DUTY = const(30)
 _RX_IDLE_LEVEL = const(1)
 _RX_SIZE = const(1023)
+_QUEUE_SIZE = const(16)
+
+# Binary frame: SYNC, length of the payload (2 bytes), command, id, payload, CRC16 (2 bytes)
+# Multi-byte values are little endian, and a duration is 3 bytes.
+# The CRC16-CCITT (0x1021, initial 0xffff) covers the length, the command, the id and the payload.
+# The reply has the id of the request, and its payload begins with the status.
+# Several requests can be running, and their replies may come out of order.
+_VERSION = const(2)
+_PIPELINE_MAX = const(8)     # Requests running at once
+_HEAD = const(4)             # Length, command and id of a request after SYNC
+_PAYLOAD = const(6)          # SYNC, length, command, id and status of a reply
+_SYNC = const(0xa5)
+_FRAME_MAX = const(8192)
+_CMD_HELLO   = const(0x01)   # -> version, capabilities(2), max durations(2), _PIPELINE_MAX
+_CMD_RECORD  = const(0x10)   # wait[ms](4), blank[ms](2), size(2) -> durations
+_CMD_DECODE  = const(0x11)   # same as _CMD_RECORD -> 1, protocol, address(2), repeats, command
+                             #                     or 0, durations
+_CMD_SEND    = const(0x20)   # durations
+_CMD_ENCODE  = const(0x21)   # protocol, address(2), repeats, command(2 or AEHA bytes)
+_CMD_SEND_ID = const(0x22)   # id(2)
+_CMD_UPLOAD  = const(0x23)   # id(2), durations
+_CMD_DELETE  = const(0x24)   # id(2)
+_CMD_LIST    = const(0x25)   # -> [id(2), number of durations(2)] * n
+_CMD_TEXT    = const(0x30)   # text command -> text reply
+_CMD_EXIT    = const(0x7f)   # back to the text commands
+_REPLY = const(0x80)         # Command of the reply
+_ST_OK      = const(0)
+_ST_NG      = const(1)
+_ST_CRC     = const(2)
+_ST_UNKNOWN = const(3)
+_ST_BUSY    = const(4)       # _PIPELINE_MAX requests are running
+_CAPABILITIES = const(0x0f)  # 1: record, 2: send, 4: store, 8: text
+_CAP_STORE    = const(0x04)
+_PROTOCOLS = ('NEC', 'AEHA', 'SIRC12', 'SIRC15', 'SIRC20', 'RC5', 'RC6')
 
 rx_pin = Pin(_GROVE_PIN[_DEVICE][0], Pin.IN)
 rx = UpyIrRx(rx_pin, _RX_SIZE, _RX_IDLE_LEVEL)
 
 tx_pin = Pin(_GROVE_PIN[_DEVICE][1], Pin.OUT)
 tx = UpyIrTx(0, tx_pin, _TX_FREQ, _TX_DUTY, _TX_IDLE_LEVEL)
+queue = UpyIrTxQueue(tx, _QUEUE_SIZE) if UpyIrTxQueue else None
+store = UpyIrStore() if UpyIrStore else None
+capabilities = _CAPABILITIES if store else _CAPABILITIES & ~_CAP_STORE
+# A binary request waits for the receiver or the transmitter used by another one
+rx_lock = asyncio.Lock()
+tx_lock = asyncio.Lock()
+running = 0
+# Preallocated frames. A request is parsed before the next one is read,
+# and a reply is written out before another task runs.
+rx_frame = bytearray(_HEAD + _FRAME_MAX + 2)
+tx_frame = bytearray(_PAYLOAD + _FRAME_MAX + 2)
+tx_view = memoryview(tx_frame)
 
-cmd = input()
-while cmd != 'q':
-    if len(cmd) > 0:
-        if cmd[0] == 'r':
-            # ex. cmd: 'r[3000, 200, 1023]
-            try:
-                _wait, _blank, _size = json.loads(cmd[1:])
-                if rx.record(_wait, _blank, _size) == UpyIrRx.ERROR_NONE:
-                    print(rx.get_calibrate_list())
+_crc_table = array('H', [0] * 256)
+for i in range(256):
+    c = i << 8
+    for j in range(8):
+        c = ((c << 1) ^ 0x1021) if c & 0x8000 else (c << 1)
+    _crc_table[i] = c & 0xffff
+
+@micropython.native
+def crc16(data, crc=0xffff):
+    table = _crc_table
+    for b in data:
+        crc = ((crc << 8) & 0xffff) ^ table[((crc >> 8) ^ b) & 0xff]
+    return(crc)
+
+def pack_into(buf, offset, signal):
+    # Durations -> 3 bytes each. Return the number of bytes.
+    if offset + 3 * len(signal) > len(buf):
+        raise(IndexError())
+    for d in signal:
+        buf[offset] = d & 0xff
+        buf[offset + 1] = (d >> 8) & 0xff
+        buf[offset + 2] = (d >> 16) & 0xff
+        offset += 3
+    return(3 * len(signal))
+
+def unpack(data):
+    signal = array('I', [0] * (len(data) // 3))
+    for i in range(len(signal)):
+        signal[i] = data[3*i] | (data[3*i + 1] << 8) | (data[3*i + 2] << 16)
+    return(signal)
+
+def command(cmd):
+    # Text command -> reply
+    if cmd[0] == 'r':
+        # ex. cmd: 'r[3000, 200, 1023]
+        try:
+            _wait, _blank, _size = json.loads(cmd[1:])
+            if rx.record(_wait, _blank, _size) == UpyIrRx.ERROR_NONE:
+                return(str(rx.get_calibrate_list()))
+            else:
+                return('[]')
+        except:
+            return('[]')
+    elif cmd[0] == 'd':
+        # ex. cmd: 'd[3000, 200, 1023]
+        # ack: '["NEC", 4, 8, 0]', or waveform data list if unknown
+        try:
+            _wait, _blank, _size = json.loads(cmd[1:])
+            if rx.record(_wait, _blank, _size) == UpyIrRx.ERROR_NONE:
+                signal = rx.get_calibrate_list()
+                code = decode(signal)
+                if code:
+                    _protocol, _address, _command, _repeats = code
+                    if isinstance(_command, bytes):
+                        _command = list(_command)
+                    return(json.dumps([_protocol, _address, _command, _repeats]))
                 else:
-                    print('[]')
-            except:
-                print('[]')
-        elif cmd[0] == 'w':
-            # ex. cmd: 'w[420, 1260, 420, ...]
+                    return(str(signal))
+            else:
+                return('[]')
+        except:
+            return('[]')
+    elif cmd[0] == 'w':
+        # ex. cmd: 'w[420, 1260, 420, ...]
+        try:
+            if tx.send(json.loads(cmd[1:])):
+                return('OK')
+            else:
+                return('NG')
+        except:
+            return('NG')
+    elif cmd[0] == 'e':
+        # ex. cmd: 'e["NEC", 4, 8, 0]
+        try:
+            _protocol, _address, _command, _repeats = json.loads(cmd[1:])
+            signal = encode(_protocol, _address, _command, _repeats)
+            if signal and tx.send(signal):
+                return('OK')
+            else:
+                return('NG')
+        except:
+            return('NG')
+    elif cmd[0] == 'b':
+        # ex. cmd: 'b[[["NEC", 4, 8, 0], 1, 0, 0, 0, 0], [[420, 1260, ...], 3, 40000, 0, 2000, 3000]]
+        #   [signal, count, gap[us], priority, start[ms], deadline[ms]] for each entry.
+        #   signal is a waveform data list, [protocol, address, command, repeats] or a stored id.
+        # ack: '["OK", "LATE", ...]' in the order of the entries
+        if queue is None:
+            return('[]')
+        try:
+            ids = []
+            for entry in json.loads(cmd[1:]):
+                signal = entry[0]
+                if isinstance(signal, int):
+                    signal = store.get(signal) if store else None
+                elif signal and isinstance(signal[0], str):
+                    signal = encode(*signal)
+                ids.append(queue.put(signal, *entry[1:]))
+            results = dict(queue.run())
+            return(json.dumps([('OK', 'NG', 'LATE')[results[i]] if i in results else 'NG' for i in ids]))
+        except:
+            queue.clear()
+            return('[]')
+    elif cmd[0] in 'sulx' and store is None:
+        # Without UpyIrStore.py
+        return('[]' if cmd[0] == 'l' else 'NG')
+    elif cmd[0] == 's':
+        # ex. cmd: 's5
+        # Send the stored signal of the id
+        try:
+            signal = store.get(int(cmd[1:]))
+            if signal and tx.send(signal):
+                return('OK')
+            else:
+                return('NG')
+        except:
+            return('NG')
+    elif cmd[0] == 'u':
+        # ex. cmd: 'u[5, [420, 1260, 420, ...]]
+        # Save the signal with the id in the flash
+        try:
+            _id, signal = json.loads(cmd[1:])
+            if store.put(_id, signal):
+                return('OK')
+            else:
+                return('NG')
+        except:
+            return('NG')
+    elif cmd[0] == 'l':
+        # ack: '[[5, 67], ...]' [id, number of durations] of the stored signals
+        return(json.dumps(store.list()))
+    elif cmd[0] == 'x':
+        # ex. cmd: 'x5
+        # Delete the stored signal of the id
+        try:
+            if store.delete(int(cmd[1:])):
+                return('OK')
+            else:
+                return('NG')
+        except:
+            return('NG')
+    else:
+        return('NG')
+
+def parse(cmd, data):
+    # Arguments of a binary command, taken out of rx_frame before the next request is read
+    if cmd == _CMD_RECORD or cmd == _CMD_DECODE:
+        return(struct.unpack('<IHH', data))
+    elif cmd == _CMD_SEND:
+        return(unpack(data))
+    elif cmd == _CMD_ENCODE:
+        _protocol, _address, _repeats = struct.unpack('<BHB', data[:4])
+        _protocol = _PROTOCOLS[_protocol]
+        _command = bytes(data[4:])
+        if _protocol != 'AEHA':
+            _command = struct.unpack('<H', _command)[0]
+        return(encode(_protocol, _address, _command, _repeats))
+    elif cmd == _CMD_SEND_ID or cmd == _CMD_DELETE:
+        return(struct.unpack('<H', data)[0])
+    elif cmd == _CMD_UPLOAD:
+        return((struct.unpack('<H', data[:2])[0], unpack(data[2:])))
+    elif cmd == _CMD_TEXT:
+        return(str(data, 'utf-8'))
+    return(None)
+
+async def binary_command(cmd, arg):
+    # Binary command -> (status, length of the payload written in tx_frame)
+    # The payload is written after the last await, so the other tasks do not overwrite it.
+    if cmd == _CMD_HELLO:
+        struct.pack_into('<BHHB', tx_frame, _PAYLOAD, _VERSION, capabilities, _RX_SIZE, _PIPELINE_MAX)
+        return(_ST_OK, 6)
+    elif cmd == _CMD_RECORD or cmd == _CMD_DECODE:
+        async with rx_lock:
+            if await rx.arecord(arg[0], arg[1], arg[2]) != UpyIrRx.ERROR_NONE:
+                return(_ST_NG, 0)
+            signal = rx.get_calibrate_list()
+        if cmd == _CMD_RECORD:
+            return(_ST_OK, pack_into(tx_frame, _PAYLOAD, signal))
+        code = decode(signal)
+        if not code:
+            tx_frame[_PAYLOAD] = 0
+            return(_ST_OK, 1 + pack_into(tx_frame, _PAYLOAD + 1, signal))
+        _protocol, _address, _command, _repeats = code
+        if not isinstance(_command, bytes):
+            _command = struct.pack('<H', _command)
+        struct.pack_into('<BBHB', tx_frame, _PAYLOAD, 1, _PROTOCOLS.index(_protocol), _address, _repeats)
+        tx_frame[_PAYLOAD + 5: _PAYLOAD + 5 + len(_command)] = _command
+        return(_ST_OK, 5 + len(_command))
+    elif _CMD_SEND_ID <= cmd <= _CMD_LIST and store is None:
+        return(_ST_NG, 0)
+    elif cmd == _CMD_SEND or cmd == _CMD_ENCODE:
+        signal = arg
+    elif cmd == _CMD_SEND_ID:
+        signal = store.get(arg)
+    elif cmd == _CMD_UPLOAD:
+        return(_ST_OK if store.put(arg[0], arg[1]) else _ST_NG, 0)
+    elif cmd == _CMD_DELETE:
+        return(_ST_OK if store.delete(arg) else _ST_NG, 0)
+    elif cmd == _CMD_LIST:
+        n = 0
+        for i, count in store.list():
+            struct.pack_into('<HH', tx_frame, _PAYLOAD + n, i, count)
+            n += 4
+        return(_ST_OK, n)
+    elif cmd == _CMD_TEXT:
+        # The text commands block the other requests
+        async with rx_lock:
+            async with tx_lock:
+                text = command(arg).encode()
+        if len(text) > _FRAME_MAX:
+            return(_ST_NG, 0)
+        tx_frame[_PAYLOAD: _PAYLOAD + len(text)] = text
+        return(_ST_OK, len(text))
+    else:
+        return(_ST_UNKNOWN, 0)
+    if not signal:
+        return(_ST_NG, 0)
+    async with tx_lock:
+        if await tx.asend(signal):
+            return(_ST_OK, 0)
+    return(_ST_NG, 0)
+
+def reply(out, cmd, seq, status, n=0):
+    # Write the reply straight from tx_frame. The payload of n bytes is already there.
+    tx_frame[0] = _SYNC
+    struct.pack_into('<HBBB', tx_frame, 1, n + 1, cmd | _REPLY, seq, status)
+    end = _PAYLOAD + n
+    struct.pack_into('<H', tx_frame, end, crc16(tx_view[1: end]))
+    out.write(tx_view[: end + 2])
+
+async def binary_task(out, cmd, seq, arg):
+    global running
+    try:
+        status, n = await binary_command(cmd, arg)
+    except:
+        status, n = _ST_NG, 0
+    reply(out, cmd, seq, status, n)
+    running -= 1
+    collect()
+
+async def read_into(inp, poller, view):
+    # The other tasks run until the data comes. A frame is read at once.
+    while not poller.poll(0):
+        await asyncio.sleep_ms(1)
+    inp.readinto(view)
+
+async def binary_loop():
+    # Binary frames until _CMD_EXIT. Each request runs in its own task.
+    global running
+    inp = sys.stdin.buffer
+    out = sys.stdout.buffer
+    poller = select.poll()
+    poller.register(sys.stdin, select.POLLIN)
+    view = memoryview(rx_frame)
+    sync = view[:1]
+    head = view[:_HEAD]
+    while True:
+        await read_into(inp, poller, sync)
+        if rx_frame[0] != _SYNC:
+            continue
+        await read_into(inp, poller, head)
+        n = rx_frame[0] | (rx_frame[1] << 8)
+        if n > _FRAME_MAX:
+            continue
+        await read_into(inp, poller, view[_HEAD: _HEAD + n + 2])
+        cmd = rx_frame[2]
+        seq = rx_frame[3]
+        if crc16(view[: _HEAD + n]) != rx_frame[_HEAD + n] | (rx_frame[_HEAD + n + 1] << 8):
+            reply(out, cmd, seq, _ST_CRC)
+        elif cmd == _CMD_EXIT:
+            while running:
+                await asyncio.sleep_ms(10)
+            reply(out, cmd, seq, _ST_OK)
+            return
+        elif running >= _PIPELINE_MAX:
+            reply(out, cmd, seq, _ST_BUSY)
+        else:
             try:
-                if tx.send(json.loads(cmd[1:])):
-                    print('OK')
-                else:
-                    print('NG')
+                arg = parse(cmd, view[_HEAD: _HEAD + n])
             except:
-                print('NG')
-        else:
-            print('NG')
+                reply(out, cmd, seq, _ST_NG)
+                continue
+            running += 1
+            asyncio.create_task(binary_task(out, cmd, seq, arg))
+
+def binary():
+    # Raw mode: there is no echo, and Ctrl-C is data here
+    micropython.kbd_intr(-1)
+    try:
+        asyncio.run(binary_loop())
+    finally:
+        micropython.kbd_intr(3)
+
+cmd = input()
+while cmd != 'q':
+    if cmd == 'v':
+        # ack: '["BIN", 2, 15]' version and capabilities, then binary frames
+        print(json.dumps(['BIN', _VERSION, capabilities]))
+        binary()
+    elif len(cmd) > 0:
+        print(command(cmd))
     del cmd
     collect()
     cmd = input()
@@ -0,0 +1,92 @@
+import time
+from UpyIrRx import UpyIrRx, calibrate
+
+# Records on several receivers at once (ESP32 & RaspberryPi pico)
+# The receivers are UpyIrRx or its subclasses (UpyIrRxPio, UpyIrRxRmt,
+# UpyIrRxStamp) on different pins. On ESP32, give each UpyIrRx its own
+# timer_id. The first edges are compared on the ticks_us() time base.
+
+class UpyIrRxMulti():
+
+    def __init__(self, receivers):
+        if not receivers:
+            raise(IndexError())
+        self._receivers = list(receivers)
+        self._active = []
+        self._end_ms = None
+        self._first = -1
+        self._quality = []
+
+    def get_receiver(self, index):
+        return(self._receivers[index])
+
+    def get_first(self):
+        # Index of the receiver that saw the signal first, -1 if none recorded it
+        return(self._first)
+
+    def get_quality(self):
+        # [(error code, delay[us], mean residual[us]), ...] of each receiver.
+        # delay is the time of the first edge from the first receiver.
+        return(self._quality)
+
+    def _begin(self, wait_ms, blank_ms, stop_size):
+        # Begin recording on the receivers at the idle level
+        self._active = []
+        self._end_ms = None
+        for rx in self._receivers:
+            if rx._prepare(wait_ms, blank_ms, stop_size):
+                rx._begin()
+                self._active.append(rx)
+
+    def _is_waiting(self):
+        # Wait for every receiver, but at most the blank time after the first one ends
+        waiting = False
+        for rx in self._active:
+            if rx._is_waiting():
+                waiting = True
+            elif self._end_ms is None:
+                self._end_ms = time.ticks_ms()
+        if waiting and self._end_ms is not None:
+            return(time.ticks_diff(time.ticks_ms(), self._end_ms)*1000 < self._active[0]._blank_us)
+        return(waiting)
+
+    def _finish(self):
+        # Judge each receiver, and find the first one by its first edge
+        first = {}
+        for i in range(len(self._receivers)):
+            rx = self._receivers[i]
+            if rx in self._active:
+                rx._finish()
+            if rx._error == UpyIrRx.ERROR_NONE:
+                first[i] = rx._first_edge()
+            rx._publish()
+        self._first = -1
+        for i in first:
+            if self._first < 0 or time.ticks_diff(first[i], first[self._first]) < 0:
+                self._first = i
+        self._quality = []
+        for i in range(len(self._receivers)):
+            rx = self._receivers[i]
+            if i in first:
+                residual = calibrate(rx._decode())[2]
+                self._quality.append((UpyIrRx.ERROR_NONE, time.ticks_diff(first[i], first[self._first]), residual))
+            else:
+                self._quality.append((rx.get_error_code(), 0, 0))
+        if self._first < 0:
+            return(self._receivers[0].get_error_code())
+        return(UpyIrRx.ERROR_NONE)
+
+    def record(self, wait_ms=0, blank_ms=0, stop_size=0):
+        # ERROR_NONE if any receiver recorded the signal
+        self._begin(wait_ms, blank_ms, stop_size)
+        while self._is_waiting():
+            time.sleep_ms(1)
+        return(self._finish())
+
+    async def arecord(self, wait_ms=0, blank_ms=0, stop_size=0):
+        # Same as record(), but other tasks run while waiting for the signal
+        import uasyncio as asyncio
+        self._begin(wait_ms, blank_ms, stop_size)
+        while self._is_waiting():
+            await asyncio.sleep_ms(1)
+        return(self._finish())
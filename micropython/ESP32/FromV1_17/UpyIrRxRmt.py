@@ -0,0 +1,146 @@
+from machine import mem32, Pin
+from micropython import const
+import time
+from time import ticks_us
+from UpyIrRx import UpyIrRx
+
+# IR RX class for ESP32 (ESP32 chip only, not S2/S3/C3)
+# The RMT peripheral records the edges and finds the end of the signal
+# by the idle threshold. esp32.RMT has no receive mode in micropython,
+# so the RMT registers are set directly.
+# The RMT has no time stamp. The first edge is time stamped by a pin interrupt,
+# so UpyIrRxMulti can compare it with the other receivers.
+
+_DPORT_PERIP_CLK_EN = const(0x3FF000C0)
+_DPORT_PERIP_RST_EN = const(0x3FF000C4)
+_DPORT_RMT_BIT      = const(0x200)
+_GPIO_FUNC_IN_SEL   = const(0x3FF44130)  # + 4*signal
+_RMT_SIG_IN0        = const(83)
+_RMT_CONF0          = const(0x3FF56020)  # + 8*ch
+_RMT_CONF1          = const(0x3FF56024)  # + 8*ch
+_RMT_INT_RAW        = const(0x3FF560A0)
+_RMT_INT_CLR        = const(0x3FF560AC)
+_RMT_APB_CONF       = const(0x3FF560F0)
+_RMT_RAM            = const(0x3FF56800)  # + 256*block
+_RMT_BLOCK_ITEMS    = const(64)          # 32bit items per memory block
+_APB_MHZ            = const(80)
+_DURATION_MAX       = const(32767)       # 15bit duration field
+_FILTER_DEFAULT     = const(255)         # Glitch filter [APB cycles](=3.2us)
+# CONF1 bits
+_RX_EN         = const(0x02)
+_MEM_WR_RST    = const(0x04)
+_MEM_OWNER_RX  = const(0x20)
+_RX_FILTER_EN  = const(0x80)
+_REF_ALWAYS_ON = const(0x20000)
+
+def _pin_id(pin):
+    # 'Pin(32)' -> 32
+    return(int(str(pin)[4:-1]))
+
+class UpyIrRxRmt(UpyIrRx):
+
+    def __init__(self, ch, pin, max_size=0, idle_level=1, encoding=0, tick_us=1):
+        if ch < 0 or ch > 7:
+            raise(IndexError())
+        self._ch = ch
+        super().__init__(pin, max_size, idle_level, encoding=encoding, tick_us=tick_us)
+
+    def _attach(self):
+        # Channel ch uses memory blocks ch ... ch+blocks-1.
+        # One item holds two durations, and the last one ends with 0.
+        ch = self._ch
+        self._blocks = min(8 - ch, (self._max_size + 2 + _RMT_BLOCK_ITEMS*2 - 1) // (_RMT_BLOCK_ITEMS*2))
+        if self._max_size > self._blocks * _RMT_BLOCK_ITEMS * 2 - 1:
+            self._max_size = self._blocks * _RMT_BLOCK_ITEMS * 2 - 1
+        mem32[_DPORT_PERIP_CLK_EN] |= _DPORT_RMT_BIT
+        mem32[_DPORT_PERIP_RST_EN] &= ~_DPORT_RMT_BIT
+        mem32[_RMT_APB_CONF] |= 1    # Direct memory access
+        mem32[_GPIO_FUNC_IN_SEL + 4*(_RMT_SIG_IN0 + ch)] = 0x80 | _pin_id(self._pin)
+        mem32[_RMT_CONF1 + 8*ch] = _REF_ALWAYS_ON | _MEM_OWNER_RX
+        self._end_bits = 6 << (3*ch)    # RX_END | ERR
+
+    def _items(self):
+        ram = _RMT_RAM + 256*self._ch
+        for i in range(self._blocks * _RMT_BLOCK_ITEMS):
+            item = mem32[ram + 4*i]
+            yield(item & 0xffff)
+            yield((item >> 16) & 0xffff)
+
+    def _durations(self):
+        # Durations [us] from the first edge to the end mark
+        first = True
+        for d in self._items():
+            if not d & 0x7fff:
+                return
+            if first and (d >> 15) == self._idle_level:
+                # Idle section before the first edge
+                continue
+            first = False
+            yield(((d & 0x7fff)*self._div + _APB_MHZ//2) // _APB_MHZ)
+
+    def _begin(self):
+        # The idle threshold is up to 15bit ticks. One tick is div/80 [us].
+        div = (self._blank_us*_APB_MHZ + _DURATION_MAX - 1) // _DURATION_MAX
+        if div < _APB_MHZ:
+            div = _APB_MHZ
+        elif div > 256:
+            div = 256
+        thres = self._blank_us*_APB_MHZ // div
+        if thres > _DURATION_MAX:
+            thres = _DURATION_MAX
+        self._div = div
+        self._thres_us = thres*div // _APB_MHZ
+        self._end_us = 0
+        ch = self._ch
+        conf0 = _RMT_CONF0 + 8*ch
+        conf1 = _RMT_CONF1 + 8*ch
+        mem32[conf0] = (mem32[conf0] & 0xc0000000) | (self._blocks << 24) | (thres << 8) | (div & 0xff)
+        self._conf1 = _REF_ALWAYS_ON | _MEM_OWNER_RX | _RX_FILTER_EN | (_FILTER_DEFAULT << 8)
+        mem32[conf1] = self._conf1 | _MEM_WR_RST
+        mem32[_RMT_RAM + 256*ch] = 0
+        mem32[_RMT_INT_CLR] = self._end_bits
+        # begin recording
+        self._mode = UpyIrRx.MODE_READY
+        self._first_us = None
+        dmy = self._pin.irq(trigger=(Pin.IRQ_FALLING if self._idle_level else Pin.IRQ_RISING),
+                            handler=self._stamp_first, hard=True)
+        mem32[conf1] = self._conf1 | _RX_EN
+        self._start_ms = time.ticks_ms()
+
+    def _is_waiting(self):
+        if mem32[_RMT_INT_RAW] & self._end_bits:
+            self._end_us = time.ticks_us()
+            return(False)
+        return(time.ticks_diff(time.ticks_ms(), self._start_ms) < self._wait_ms)
+
+    def _stamp_first(self, p):
+        # Called on the edges leaving the idle level. Do not allocate heap memory here.
+        if self._first_us is None:
+            self._first_us = ticks_us()
+
+    def _first_edge(self):
+        # Without the time stamp, count back from the end found by polling
+        if self._first_us is not None:
+            return(self._first_us)
+        return(time.ticks_add(self._end_us, -(sum(self._durations()) + self._thres_us)))
+
+    def _finish(self):
+        ch = self._ch
+        dmy = self._pin.irq(handler=None)
+        mem32[_RMT_CONF1 + 8*ch] = self._conf1
+        status = mem32[_RMT_INT_RAW] & self._end_bits
+        mem32[_RMT_INT_CLR] = self._end_bits
+        # judgement
+        if status & (4 << (3*ch)):
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_OVERFLOW
+            return(self._error)
+        if not status:
+            self._mode = UpyIrRx.MODE_DONE_NG
+            if mem32[_RMT_RAM + 256*ch]:
+                self._error = UpyIrRx.ERROR_TIMEOUT
+            else:
+                self._error = UpyIrRx.ERROR_NO_DATA
+            return(self._error)
+        # The RMT filter removes pulses up to 3.2us, the rest are removed by software
+        return(self._store(self._durations()))
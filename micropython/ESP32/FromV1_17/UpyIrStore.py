@@ -0,0 +1,189 @@
+import os
+import struct
+from array import array
+from micropython import const
+
+# Signal store in the file system for ESP32 & RaspberryPi pico
+# The file has a fixed index of the slots (id = slot number), followed by
+# the durations packed in 3 bytes (little endian, up to 16,777,215us).
+# A few decoded signals are kept in RAM, the least recently used is dropped.
+
+_MAGIC = b'IRS1'
+_HEAD = const(6)           # magic, number of slots
+_SLOT = const(6)           # offset, number of durations
+_DURATION_BYTES = const(3)
+_DURATION_MAX = const(0xffffff)
+_COUNT_MAX = const(0xffff)
+
+class UpyIrStore():
+
+    def __init__(self, path='signals.bin', slots=64, cache=4):
+        # The number of slots of an existing file is used.
+        # A broken file is kept as path + '.bad', and an empty store is made.
+        self._path = path
+        self._cache_size = cache
+        self._cache = {}
+        self._order = []
+        self._recover(path)
+        try:
+            self._load(path)
+            return
+        except OSError:
+            pass
+        except Exception:
+            self._remove(path + '.bad')
+            os.rename(path, path + '.bad')
+        self._index = [(0, 0)] * slots
+        self._size = self._create(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _recover(self, path):
+        # compact() stopped by a power loss: the old file is used again if the new one is not in place
+        try:
+            os.stat(path)
+        except OSError:
+            try:
+                os.rename(path + '.old', path)
+            except OSError:
+                pass
+        self._remove(path + '.old')
+        self._remove(path + '.tmp')
+
+    def _load(self, path):
+        # ValueError for a broken file
+        with open(path, 'rb') as f:
+            head = f.read(_HEAD)
+            if len(head) != _HEAD:
+                raise(ValueError())
+            magic, slots = struct.unpack('<4sH', head)
+            if magic != _MAGIC:
+                raise(ValueError())
+            data = f.read(_SLOT*slots)
+            if len(data) != _SLOT*slots:
+                raise(ValueError())
+            index = [struct.unpack('<IH', data[_SLOT*i: _SLOT*(i + 1)]) for i in range(slots)]
+            f.seek(0, 2)
+            size = f.tell()
+        for offset, count in index:
+            if count and (offset < _HEAD + _SLOT*slots or offset + count*_DURATION_BYTES > size):
+                raise(ValueError())
+        self._index = index
+        self._size = size
+
+    def _create(self, path):
+        # Empty store. Return the file size.
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<4sH', _MAGIC, len(self._index)))
+            for offset, count in self._index:
+                f.write(struct.pack('<IH', offset, count))
+        return(_HEAD + _SLOT*len(self._index))
+
+    def _write_slot(self, f, sig_id):
+        f.seek(_HEAD + _SLOT*sig_id)
+        f.write(struct.pack('<IH', *self._index[sig_id]))
+
+    def _forget(self, sig_id):
+        if sig_id in self._cache:
+            del self._cache[sig_id]
+            self._order.remove(sig_id)
+
+    def put(self, sig_id, signal_tuple):
+        # Save the signal in the slot sig_id. An old signal is replaced.
+        if sig_id < 0 or sig_id >= len(self._index):
+            return(False)
+        count = len(signal_tuple)
+        if count == 0 or count % 2 == 0 or count > _COUNT_MAX:
+            return(False)
+        data = bytearray(count * _DURATION_BYTES)
+        for i in range(count):
+            d = signal_tuple[i]
+            if d < 0 or d > _DURATION_MAX:
+                return(False)
+            data[3*i] = d & 0xff
+            data[3*i + 1] = (d >> 8) & 0xff
+            data[3*i + 2] = d >> 16
+        with open(self._path, 'r+b') as f:
+            f.seek(self._size)
+            f.write(data)
+            self._index[sig_id] = (self._size, count)
+            self._write_slot(f, sig_id)
+        self._size += len(data)
+        self._forget(sig_id)
+        self._compact_if_needed()
+        return(True)
+
+    def get(self, sig_id):
+        # array('I') of the durations, or None for an empty slot
+        if sig_id in self._cache:
+            self._order.remove(sig_id)
+            self._order.append(sig_id)
+            return(self._cache[sig_id])
+        if sig_id < 0 or sig_id >= len(self._index):
+            return(None)
+        offset, count = self._index[sig_id]
+        if count == 0:
+            return(None)
+        with open(self._path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(count * _DURATION_BYTES)
+        signal = array('I', [0] * count)
+        for i in range(count):
+            signal[i] = data[3*i] | (data[3*i + 1] << 8) | (data[3*i + 2] << 16)
+        if self._cache_size > 0:
+            if len(self._order) >= self._cache_size:
+                del self._cache[self._order.pop(0)]
+            self._cache[sig_id] = signal
+            self._order.append(sig_id)
+        return(signal)
+
+    def delete(self, sig_id):
+        if sig_id < 0 or sig_id >= len(self._index) or self._index[sig_id][1] == 0:
+            return(False)
+        self._index[sig_id] = (0, 0)
+        with open(self._path, 'r+b') as f:
+            self._write_slot(f, sig_id)
+        self._forget(sig_id)
+        self._compact_if_needed()
+        return(True)
+
+    def list(self):
+        # [(id, number of durations), ...] of the saved signals
+        return([(i, self._index[i][1]) for i in range(len(self._index)) if self._index[i][1]])
+
+    def _compact_if_needed(self):
+        # Rewrite the file when the replaced and deleted signals take more than the saved ones
+        used = 0
+        for offset, count in self._index:
+            used += count * _DURATION_BYTES
+        if self._size - _HEAD - _SLOT*len(self._index) - used > used:
+            self.compact()
+
+    def compact(self):
+        # Copy the saved signals to a new file without the gaps.
+        # The old file is removed after the new one is in place.
+        tmp = self._path + '.tmp'
+        index = self._index
+        self._index = [(0, 0)] * len(index)
+        size = self._create(tmp)
+        with open(self._path, 'rb') as src:
+            with open(tmp, 'r+b') as dst:
+                dst.seek(size)
+                for i in range(len(index)):
+                    offset, count = index[i]
+                    if count:
+                        src.seek(offset)
+                        dst.write(src.read(count * _DURATION_BYTES))
+                        self._index[i] = (size, count)
+                        self._write_slot(dst, i)
+                        dst.seek(0, 2)
+                        size += count * _DURATION_BYTES
+        old = self._path + '.old'
+        os.rename(self._path, old)
+        os.rename(tmp, self._path)
+        os.remove(old)
+        self._size = size
@@ -1,20 +1,52 @@
 import esp32
+from machine import mem32
+from micropython import const
 import time
 
 # IR TX class for ESP32
 # micropython v1.17 - v1.18(latest as of 2022/5)
+# stream() refills the RMT memory by the registers (ESP32 chip only, not S2/S3/C3).
+
+_DURATION_MAX = const(32767)   # 15bit duration of a RMT item [us]
+_RMT_CONF0       = const(0x3FF56020)  # + 8*ch
+_RMT_CONF1       = const(0x3FF56024)  # + 8*ch
+_RMT_INT_RAW     = const(0x3FF560A0)
+_RMT_INT_ENA     = const(0x3FF560A8)
+_RMT_INT_CLR     = const(0x3FF560AC)
+_RMT_TX_LIM      = const(0x3FF560D0)  # + 4*ch
+_RMT_APB_CONF    = const(0x3FF560F0)
+_RMT_RAM         = const(0x3FF56800)  # + 256*block
+_RMT_BLOCK_ITEMS = const(64)          # 32bit items per memory block
+# CONF1 bits
+_TX_START   = const(0x01)
+_MEM_RD_RST = const(0x08)
+# APB_CONF bits
+_MEM_TX_WRAP_EN = const(0x02)
 
 class UpyIrTx():
 
     def __init__(self, ch, pin, freq=38000, duty=30, idle_level=0):
         self._raise = False
-        if freq <= 0 or duty <= 0 or duty >= 100 or ch < 0 or ch > 7:
+        if ch < 0 or ch > 7:
+            raise(IndexError())
+        self._ch = ch
+        self._pin = pin
+        self._idle_level = idle_level
+        self._rmt = None
+        self.set_carrier(freq, duty)
+
+    def set_carrier(self, freq, duty):
+        # Change the carrier between transmissions
+        if freq <= 0 or duty <= 0 or duty >= 100:
             raise(IndexError())
-        if idle_level:
-            self._rmt = esp32.RMT(ch, pin=pin, clock_div=80, tx_carrier=(freq, (100-duty), 0), idle_level=True)
+        if self._rmt:
+            self._rmt.wait_done(timeout=2000)
+            self._rmt.deinit()
+        if self._idle_level:
+            self._rmt = esp32.RMT(self._ch, pin=self._pin, clock_div=80, tx_carrier=(freq, (100-duty), 0), idle_level=True)
             self._posi = 0
         else:
-            self._rmt = esp32.RMT(ch, pin=pin, clock_div=80, tx_carrier=(freq, duty, 1), idle_level=False)
+            self._rmt = esp32.RMT(self._ch, pin=self._pin, clock_div=80, tx_carrier=(freq, duty, 1), idle_level=False)
             self._posi = 1
 
     def send_raw(self, signal_tuple):
@@ -25,38 +57,179 @@ class UpyIrTx():
             self._rmt.wait_done(timeout=2000)
         return(True)
     
+    def _items(self, signal_tuple):
+        # Durations and levels of the RMT items for write_pulses().
+        # A duration of 32768us or more is split into items of the same level,
+        # so the whole signal is timed by the RMT.
+        durations = []
+        levels = []
+        level = self._posi
+        for d in signal_tuple:
+            n = (d + _DURATION_MAX - 1) // _DURATION_MAX
+            for i in range(n):
+                durations.append(d // n + (1 if i < d % n else 0))
+                levels.append(level)
+            level ^= 1
+        return(durations, levels)
+
+    def _write(self, signal_tuple):
+        # Begin the transmission. Return the timeout [ms] for wait_done().
+        durations, levels = self._items(signal_tuple)
+        self._rmt.write_pulses(durations, levels)
+        return(sum(durations)//1000 + 100)
+
     def send(self, signal_tuple):
         # Blocking until transmission
         # Value[us] is free
         if not signal_tuple:
             return(True)
-        overindex = []
-        offsets = []
-        cumsum = 0
-        len_signal = len(signal_tuple)
-        if len_signal % 2 == 0:
+        if isinstance(signal_tuple[0], (tuple, list)):
+            return(self._send_segments(signal_tuple))
+        if len(signal_tuple) % 2 == 0:
             return(False)
-        for i in range(len_signal):
-            if signal_tuple[i] >= 32768:
-                if i % 2 == 0:
-                    return(False)
+        self._rmt.wait_done(timeout=self._write(signal_tuple))
+        return(True)
+
+    def _send_segments(self, segments):
+        # [(frame, gap, count), ...] of UpyIrProtocol.compress()
+        # The frames and the gaps are streamed in one transmission of the RMT.
+        return(self.stream(segments))
+
+    def _pulses(self, signal_tuple):
+        # Half items (level << 15 | duration) of the signal.
+        # The segments of compress() are repeated without expanding them.
+        if isinstance(signal_tuple[0], (tuple, list)):
+            last = len(signal_tuple) - 1
+            for j in range(len(signal_tuple)):
+                frame, gap, count = signal_tuple[j]
+                for i in range(count):
+                    yield from self._pulses(frame)
+                    if j < last or i < count - 1:
+                        yield from self._pulse(gap, self._posi ^ 1)
+            return
+        level = self._posi
+        for d in signal_tuple:
+            yield from self._pulse(d, level)
+            level ^= 1
+
+    def _pulse(self, d, level):
+        # A duration of 32768us or more is split into items of the same level
+        n = (d + _DURATION_MAX - 1) // _DURATION_MAX
+        for i in range(n):
+            yield((level << 15) | (d // n + (1 if i < d % n else 0)))
+
+    def _words(self, signal_tuple, offset_us=0):
+        # 32bit items of two durations. The last one ends with 0 (end mark).
+        # A phase offset is an idle level before the signal.
+        lo = 0
+        for pulses in (self._pulse(offset_us, self._posi ^ 1), self._pulses(signal_tuple)):
+            for p in pulses:
+                if lo:
+                    yield(lo | (p << 16))
+                    lo = 0
                 else:
-                    overindex.append(i)
-                    offsets.append(cumsum)
-                    cumsum = 0
-            else:
-                cumsum += signal_tuple[i]
-        if len(overindex) == 0:
-            self._rmt.write_pulses(signal_tuple, self._posi)
-            self._rmt.wait_done(timeout=2000)
-        else:
-            last_index = 0
-            for i in range(len(overindex)):
-                self._rmt.write_pulses(signal_tuple[last_index: overindex[i]], self._posi)
-                time.sleep_us(signal_tuple[overindex[i]]+offsets[i])
-                last_index = overindex[i] + 1
-            self._rmt.write_pulses(signal_tuple[last_index: len_signal], self._posi)
-            self._rmt.wait_done(timeout=2000)
+                    lo = p
+        yield(lo)
+
+    def _fill(self, words, addr, n):
+        # Write up to n items to the RMT memory. False after the end mark.
+        for i in range(n):
+            w = next(words)
+            mem32[addr + 4*i] = w
+            if not w >> 16:
+                return(False)
+        return(True)
+
+    def _check(self, signal_tuple):
+        # Durations of an odd number, or the segments of compress()
+        if isinstance(signal_tuple[0], (tuple, list)):
+            for frame, gap, count in signal_tuple:
+                if len(frame) % 2 == 0 or count < 1:
+                    return(False)
+            return(True)
+        return(len(signal_tuple) % 2 == 1)
+
+    def _load(self, signal_tuple, offset_us=0):
+        # Fill the RMT memory for stream(), but do not start.
+        # The events of the channel are polled, not handled by the interrupt of the RMT driver.
+        ch = self._ch
+        self._ram = _RMT_RAM + 256*ch
+        self._conf1 = _RMT_CONF1 + 8*ch
+        self._half = ((mem32[_RMT_CONF0 + 8*ch] >> 24) & 0xf) * _RMT_BLOCK_ITEMS // 2
+        self._end_bit = 1 << (3*ch)       # TX_END
+        self._thr_bit = 1 << (24 + ch)    # TX_THR_EVENT
+        bits = self._end_bit | self._thr_bit
+        self._ena = mem32[_RMT_INT_ENA] & bits
+        self._apb = mem32[_RMT_APB_CONF]
+        mem32[_RMT_INT_ENA] &= ~bits
+        mem32[_RMT_INT_CLR] = bits
+        mem32[_RMT_APB_CONF] = self._apb | _MEM_TX_WRAP_EN
+        mem32[_RMT_TX_LIM + 4*ch] = self._half
+        self._source = self._words(signal_tuple, offset_us)
+        self._more = self._fill(self._source, self._ram, self._half) and \
+                     self._fill(self._source, self._ram + 4*self._half, self._half)
+        self._offset = 0
+        mem32[self._conf1] |= _MEM_RD_RST
+        mem32[self._conf1] &= ~_MEM_RD_RST
+
+    def _is_sending(self):
+        # Each event tells that a half has been sent. The half after the end mark is kept.
+        # False at the end of the transmission.
+        raw = mem32[_RMT_INT_RAW]
+        if raw & self._end_bit:
+            return(False)
+        if self._more and raw & self._thr_bit:
+            mem32[_RMT_INT_CLR] = self._thr_bit
+            self._more = self._fill(self._source, self._ram + 4*self._offset, self._half)
+            self._offset ^= self._half
+        return(True)
+
+    def _unload(self):
+        mem32[self._conf1] &= ~_TX_START
+        mem32[_RMT_INT_CLR] = self._end_bit | self._thr_bit
+        mem32[_RMT_APB_CONF] = self._apb
+        mem32[_RMT_INT_ENA] |= self._ena
+        self._source = None
+
+    def stream(self, signal_tuple):
+        # Blocking until transmission
+        # The RMT memory is refilled in halves during the transmission,
+        # so the signal (list, tuple, array or the segments of compress()) can be any length.
+        if not signal_tuple:
+            return(True)
+        if not self._check(signal_tuple):
+            return(False)
+        while not self._rmt.wait_done():
+            time.sleep_ms(1)
+        self._load(signal_tuple)
+        mem32[self._conf1] |= _TX_START
+        while self._is_sending():
+            time.sleep_ms(1)
+        self._unload()
+        return(True)
+
+    async def asend(self, signal_tuple):
+        # Same as send(), but other tasks run during transmission.
+        # The segments of compress() are streamed as in stream(), so other tasks
+        # must not block longer than half the RMT memory.
+        import uasyncio as asyncio
+        if not signal_tuple:
+            return(True)
+        if not self._check(signal_tuple):
+            return(False)
+        # write_pulses() blocks while the last transmission is running
+        while not self._rmt.wait_done():
+            await asyncio.sleep_ms(1)
+        if isinstance(signal_tuple[0], (tuple, list)):
+            self._load(signal_tuple)
+            mem32[self._conf1] |= _TX_START
+            while self._is_sending():
+                await asyncio.sleep_ms(1)
+            self._unload()
+            return(True)
+        self._write(signal_tuple)
+        while not self._rmt.wait_done():
+            await asyncio.sleep_ms(1)
         return(True)
 
     def send_cls(self, ir_rx):
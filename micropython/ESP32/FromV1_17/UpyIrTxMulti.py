@@ -0,0 +1,94 @@
+from machine import mem32, disable_irq, enable_irq
+from micropython import const
+import time
+
+# Sends on several transmitters at once (ESP32 chip only, not S2/S3/C3)
+# The transmitters are UpyIrTx objects on different RMT channels.
+# The RMT memories are filled first, and TX_START of the channels is set
+# back to back with the interrupts disabled (a few us apart). The ESP32 RMT
+# has no group start, so a phase offset is an idle item before the signal.
+
+_TX_START = const(0x01)    # CONF1 bit
+
+class UpyIrTxMulti():
+
+    def __init__(self, transmitters):
+        if not transmitters:
+            raise(IndexError())
+        self._transmitters = list(transmitters)
+
+    def get_transmitter(self, index):
+        return(self._transmitters[index])
+
+    def _begin(self, signals, offsets_us):
+        # Load the transmitters and start them. Return the active ones.
+        if len(signals) != len(self._transmitters):
+            return(None)
+        if offsets_us is None:
+            offsets_us = [0] * len(signals)
+        for signal in signals:
+            if signal is not None and (not signal or not self._transmitters[0]._check(signal)):
+                return(None)
+        active = []
+        for i in range(len(signals)):
+            if signals[i] is not None:
+                tx = self._transmitters[i]
+                tx._load(signals[i], offsets_us[i])
+                active.append(tx)
+        regs = [tx._conf1 for tx in active]
+        irq_state = disable_irq()
+        for reg in regs:
+            mem32[reg] |= _TX_START
+        enable_irq(irq_state)
+        return(active)
+
+    def _is_sending(self, active):
+        # Refill the RMT memories. False when all have been sent.
+        sending = False
+        for tx in active:
+            if tx._is_sending():
+                sending = True
+        return(sending)
+
+    def _end(self, active):
+        # In reverse order, so the registers shared by the channels get their first values back
+        for i in range(len(active) - 1, -1, -1):
+            active[i]._unload()
+
+    def _wait_done(self):
+        for tx in self._transmitters:
+            while not tx._rmt.wait_done():
+                time.sleep_ms(1)
+
+    def send(self, signals, offsets_us=None):
+        # Blocking until transmission
+        # signals: the durations (or the segments of compress()) of each transmitter,
+        #          None for no transmission.
+        # offsets_us: the idle time of each transmitter before its signal [us].
+        self._wait_done()
+        active = self._begin(signals, offsets_us)
+        if active is None:
+            return(False)
+        while self._is_sending(active):
+            time.sleep_ms(1)
+        self._end(active)
+        return(True)
+
+    def send_all(self, signal_tuple, offsets_us=None):
+        # The same signal on every transmitter
+        return(self.send([signal_tuple] * len(self._transmitters), offsets_us))
+
+    async def asend(self, signals, offsets_us=None):
+        # Same as send(), but other tasks run during the transmission.
+        # Other tasks must not block longer than half the RMT memory of a channel.
+        import uasyncio as asyncio
+        for tx in self._transmitters:
+            while not tx._rmt.wait_done():
+                await asyncio.sleep_ms(1)
+        active = self._begin(signals, offsets_us)
+        if active is None:
+            return(False)
+        while self._is_sending(active):
+            await asyncio.sleep_ms(1)
+        self._end(active)
+        return(True)
@@ -0,0 +1,311 @@
+from micropython import const
+
+# IR remote control protocols for ESP32 & RaspberryPi pico
+# decode(): waveform data list -> (protocol, address, command, repeats)
+# encode(): (protocol, address, command, repeats) -> waveform data list
+# compress(): waveform data list -> [(frame, gap, count), ...]
+# expand(): [(frame, gap, count), ...] -> waveform data list
+#
+# protocol  address                 command
+# 'NEC'     8bit (16bit extended)   8bit (16bit if not inverted)
+# 'AEHA'    16bit customer code     bytes after the customer code
+# 'SIRC12'  5bit                    7bit
+# 'SIRC15'  8bit                    7bit
+# 'SIRC20'  13bit                   7bit
+# 'RC5'     5bit                    7bit (RC5X)
+# 'RC6'     8bit                    8bit (mode 0)
+
+_TOLERANCE    = const(35)     # [%]
+_FRAME_GAP_US = const(5500)   # Space to separate repeated frames (SIRC20 leaves 6600us)
+_MATCH_TOLERANCE = const(15)  # [%] Same frame for compress()
+_NEC_T    = const(562)
+_AEHA_T   = const(425)
+_SIRC_T   = const(600)
+_RC5_T    = const(889)
+_RC6_T    = const(444)
+# Frame period [us] used by encode() for repeats
+_NEC_PERIOD  = const(108000)
+_AEHA_GAP    = const(13000)
+_SIRC_PERIOD = const(45000)
+_RC5_PERIOD  = const(113778)
+_RC6_PERIOD  = const(106667)
+
+_REPEAT = 'REPEAT'
+
+def _near(d, t):
+    return(abs(d - t)*100 <= t*_TOLERANCE)
+
+def _pulse_bits(frame, start, bits, t):
+    # Pulse distance coding, LSB first. Space longer than 2T is 1.
+    value = 0
+    for i in range(bits):
+        if frame[start + 2*i + 1] > 2*t:
+            value |= 1 << i
+    return(value)
+
+def _levels(frame, t, level):
+    # Levels (1: mark, 0: space) in units of t, or None
+    levels = []
+    for d in frame:
+        n = (d + t//2) // t
+        if n < 1 or n > 3:
+            return(None)
+        levels.extend([level] * n)
+        level ^= 1
+    return(levels)
+
+def _msb(bits):
+    value = 0
+    for b in bits:
+        value = (value << 1) | b
+    return(value)
+
+def _nec(frame):
+    if len(frame) == 3 and _near(frame[0], 16*_NEC_T) and _near(frame[1], 4*_NEC_T):
+        return(_REPEAT)
+    if len(frame) != 67 or not _near(frame[0], 16*_NEC_T) or not _near(frame[1], 8*_NEC_T):
+        return(None)
+    v = _pulse_bits(frame, 2, 32, _NEC_T)
+    address = v & 0xffff
+    if (address >> 8) == (~address & 0xff):
+        address &= 0xff
+    command = v >> 16
+    if (command >> 8) == (~command & 0xff):
+        command &= 0xff
+    return(('NEC', address, command))
+
+def _aeha(frame):
+    t = (frame[0] + frame[1]) // 12 if len(frame) > 2 else 0
+    if not _near(t, _AEHA_T):
+        return(None)
+    if len(frame) == 3 and _near(frame[0], 8*t) and _near(frame[1], 8*t):
+        return(_REPEAT)
+    bits = (len(frame) - 3) // 2
+    if not _near(frame[0], 8*t) or not _near(frame[1], 4*t) or len(frame) % 2 == 0 or bits < 32 or bits % 8:
+        return(None)
+    # Leader is 2:1 (RC6 is 3:1)
+    if abs(frame[0] - 2*frame[1])*100 > frame[0]*20:
+        return(None)
+    data = bytes([_pulse_bits(frame, 2 + 16*i, 8, t) for i in range(bits // 8)])
+    return(('AEHA', data[0] | (data[1] << 8), data[2:]))
+
+def _sirc(frame):
+    bits = (len(frame) - 1) // 2
+    if bits not in (12, 15, 20) or not _near(frame[0], 4*_SIRC_T):
+        return(None)
+    v = 0
+    for i in range(bits):
+        if not _near(frame[2*i + 1], _SIRC_T):
+            return(None)
+        if frame[2*i + 2] > 3*_SIRC_T//2:
+            v |= 1 << i
+    return(('SIRC%d' % bits, v >> 7, v & 0x7f))
+
+def _rc5(frame):
+    # Manchester coding, MSB first. 1 is space -> mark.
+    # The first half of the start bit is idle, so it is not recorded.
+    levels = _levels(frame, _RC5_T, 1)
+    if levels is None:
+        return(None)
+    levels = [0] + levels
+    if len(levels) == 27:
+        levels.append(0)
+    if len(levels) != 28:
+        return(None)
+    bits = []
+    for i in range(14):
+        if levels[2*i] == levels[2*i + 1]:
+            return(None)
+        bits.append(levels[2*i + 1])
+    if not bits[0]:
+        return(None)
+    command = _msb(bits[8:14]) | ((bits[1] ^ 1) << 6)
+    return(('RC5', _msb(bits[3:8]), command))
+
+def _rc6(frame):
+    # Leader 6T mark + 2T space, then Manchester coding, MSB first.
+    # 1 is mark -> space. The toggle bit is 2T per half.
+    if len(frame) < 3 or not _near(frame[0], 6*_RC6_T) or not _near(frame[1], 2*_RC6_T):
+        return(None)
+    levels = _levels(frame[2:], _RC6_T, 1)
+    if levels is None:
+        return(None)
+    if len(levels) == 43:
+        levels.append(0)
+    if len(levels) != 44:
+        return(None)
+    bits = []
+    for i in range(22):
+        if i in (4, 5):
+            # toggle bit
+            continue
+        if levels[2*i] == levels[2*i + 1]:
+            return(None)
+        bits.append(levels[2*i])
+    if not bits[0] or _msb(bits[1:4]) != 0 or levels[8] == levels[10]:
+        return(None)
+    return(('RC6', _msb(bits[4:12]), _msb(bits[12:20])))
+
+_DECODERS = (_nec, _aeha, _sirc, _rc5, _rc6)
+
+def _split(signal):
+    # Separate the signal at the spaces of _FRAME_GAP_US or more.
+    # Return (frames, gaps). The last gap is 0.
+    frames = []
+    gaps = []
+    start = 0
+    for i in range(1, len(signal), 2):
+        if signal[i] >= _FRAME_GAP_US:
+            frames.append(signal[start: i])
+            gaps.append(signal[i])
+            start = i + 1
+    frames.append(signal[start:])
+    gaps.append(0)
+    return(frames, gaps)
+
+def split_frames(signal):
+    # Separate the signal at the spaces of _FRAME_GAP_US or more
+    return(_split(signal)[0])
+
+def decode(signal):
+    # Return (protocol, address, command, repeats), or None for an unknown signal.
+    # The following frames must be repeat codes or the same code.
+    if not signal or len(signal) % 2 == 0:
+        return(None)
+    frames = split_frames(signal)
+    for func in _DECODERS:
+        code = func(frames[0])
+        if code is None or code is _REPEAT:
+            continue
+        for frame in frames[1:]:
+            repeat = func(frame)
+            if repeat is not _REPEAT and repeat != code:
+                break
+        else:
+            return((code[0], code[1], code[2], len(frames) - 1))
+    return(None)
+
+def _match(a, b, tolerance):
+    # Each duration of a is within tolerance[%] of b
+    if len(a) != len(b):
+        return(False)
+    for i in range(len(a)):
+        if abs(a[i] - b[i])*100 > b[i]*tolerance:
+            return(False)
+    return(True)
+
+def compress(signal, tolerance=_MATCH_TOLERANCE):
+    # Group the same frames in a row: [(frame, gap, count), ...]
+    # Each frame is followed by the gap, except the last one of the signal.
+    # A held key (a frame and its repeat codes) becomes a few tuples.
+    if not signal or len(signal) % 2 == 0:
+        return([])
+    frames, gaps = _split(signal)
+    segments = []
+    for i in range(len(frames)):
+        if segments:
+            frame, gap, count = segments[-1]
+            if _match(frames[i], frame, tolerance) and (gaps[i] == 0 or _match((gaps[i],), (gap,), tolerance)):
+                segments[-1] = (frame, gap, count + 1)
+                continue
+        segments.append((frames[i], gaps[i], 1))
+    return(segments)
+
+def expand(segments):
+    # [(frame, gap, count), ...] -> waveform data list
+    signal = []
+    for frame, gap, count in segments:
+        for i in range(count):
+            signal.extend(frame)
+            signal.append(gap)
+    if signal:
+        signal.pop()
+    return(signal)
+
+def _pulse_distance(value, bits, t):
+    # [mark, space, ...] LSB first. Space 3T is 1.
+    signal = []
+    for i in range(bits):
+        signal.append(t)
+        signal.append(3*t if (value >> i) & 1 else t)
+    return(signal)
+
+def _run_length(levels, t):
+    # Levels in units of t -> [mark, space, ..., mark]
+    while levels and not levels[-1]:
+        levels.pop()
+    signal = []
+    level = levels[0]
+    n = 0
+    for i in levels:
+        if i == level:
+            n += 1
+        else:
+            signal.append(n*t)
+            level = i
+            n = 1
+    signal.append(n*t)
+    return(signal)
+
+def _repeat(frame, count, period, gap=0):
+    # frame + (gap + frame) * count. Gap fills up the frame period if given.
+    if gap == 0:
+        gap = period - sum(frame)
+    signal = list(frame)
+    for i in range(count):
+        signal.append(gap)
+        signal.extend(frame)
+    return(signal)
+
+def encode(protocol, address, command, repeats=0):
+    # Return the waveform data list, or [] for an unknown protocol
+    if protocol == 'NEC':
+        if address <= 0xff:
+            address |= (~address & 0xff) << 8
+        if command <= 0xff:
+            command |= (~command & 0xff) << 8
+        frame = [16*_NEC_T, 8*_NEC_T] + _pulse_distance(address | (command << 16), 32, _NEC_T) + [_NEC_T]
+        signal = frame
+        gap = _NEC_PERIOD - sum(frame)
+        for i in range(repeats):
+            signal += [gap, 16*_NEC_T, 4*_NEC_T, _NEC_T]
+            gap = _NEC_PERIOD - 20*_NEC_T - _NEC_T
+        return(signal)
+    elif protocol == 'AEHA':
+        # The command is the data bytes (bytes or a list of int)
+        if not isinstance(command, (bytes, bytearray, list, tuple)):
+            return([])
+        data = bytes([address & 0xff, address >> 8]) + bytes(command)
+        frame = [8*_AEHA_T, 4*_AEHA_T]
+        for b in data:
+            frame += _pulse_distance(b, 8, _AEHA_T)
+        frame.append(_AEHA_T)
+        return(_repeat(frame, repeats, 0, _AEHA_GAP))
+    elif protocol in ('SIRC12', 'SIRC15', 'SIRC20'):
+        bits = int(protocol[4:])
+        value = (command & 0x7f) | (address << 7)
+        frame = [4*_SIRC_T]
+        for i in range(bits):
+            frame.append(_SIRC_T)
+            frame.append(2*_SIRC_T if (value >> i) & 1 else _SIRC_T)
+        return(_repeat(frame, repeats, _SIRC_PERIOD))
+    elif protocol == 'RC5':
+        # Start, field (inverted command bit 6), toggle, address 5bit, command 6bit
+        value = (3 << 12) | ((address & 0x1f) << 6) | (command & 0x3f)
+        if command & 0x40:
+            value &= ~(1 << 12)
+        levels = []
+        for i in range(13, -1, -1):
+            levels += [1, 0] if not (value >> i) & 1 else [0, 1]
+        # The first half of the start bit is idle
+        frame = _run_length(levels[1:], _RC5_T)
+        return(_repeat(frame, repeats, _RC5_PERIOD))
+    elif protocol == 'RC6':
+        # Leader, start 1, mode 000, toggle 0 (2T per half), address, command
+        levels = [1]*6 + [0]*2 + [1, 0] + [0, 1]*3 + [0, 0, 1, 1]
+        value = ((address & 0xff) << 8) | (command & 0xff)
+        for i in range(15, -1, -1):
+            levels += [1, 0] if (value >> i) & 1 else [0, 1]
+        frame = _run_length(levels, _RC6_T)
+        return(_repeat(frame, repeats, _RC6_PERIOD))
+    return([])
@@ -1,23 +1,123 @@
-from machine import Pin, disable_irq, enable_irq
+from machine import Pin, Timer, disable_irq, enable_irq
 from micropython import const
+import micropython
 import time
+from time import ticks_us, ticks_diff
 
 # IR RX class for ESP32 & RaspberryPi pico
 
+# Class constants used by the edge interrupt.
+# Module level const() is folded at compile time, so no lookups are needed.
+_MODE_DONE_OK   = const(1)
+_MODE_DONE_NG   = const(2)
+_MODE_READY     = const(3)
+_MODE_RECORDING = const(4)
+_MODE_LISTEN    = const(5)
+_ERROR_NONE     = const(0)
+_ERROR_OVERFLOW = const(2)
+_ENCODE_24BIT   = const(0)
+_ENCODE_16BIT   = const(1)
+_ESCAPE         = const(0xff)
+_ESCAPE16       = const(0xffff)
+# Bytes per sample of each encoding
+_ENCODE_BYTES = (3, 2, 1)
+
+# calibrate() parameters
+_MIN_UNIT_US = const(100)   # Shorter durations are noise
+_MAX_UNITS   = const(24)    # Longer durations (frame gaps) are not fitted
+_MIN_CLUSTER = const(3)     # Smaller clusters of durations are noise
+
+@micropython.native
+def calibrate(signal):
+    # Fit the base time T so that each duration is close to an integer
+    # multiple of T, and round each duration to the multiple.
+    # Return (calibrated list, T[us], mean residual[us]) or ([], 0, 0).
+    # Integer arithmetic only: T is held in 1/16 [us] as t16.
+    # Initial T: mean of the shortest cluster of _MIN_CLUSTER durations or more.
+    # A cluster spans 1.4 times its shortest duration. It includes both levels,
+    # so the delay characteristics of the receiver module cancel out.
+    # A short signal without such a cluster uses the shortest cluster of two.
+    durations = sorted(signal)
+    n = len(durations)
+    i = 0
+    while i < n and durations[i] < _MIN_UNIT_US:
+        i += 1
+    total = 0
+    count = 0
+    pair = 0
+    while i < n:
+        limit = durations[i] * 7 // 5
+        j = i
+        s = 0
+        while j < n and durations[j] < limit:
+            s += durations[j]
+            j += 1
+        if j - i >= _MIN_CLUSTER:
+            total = s
+            count = j - i
+            break
+        if j - i == 2 and not pair:
+            pair = s
+        i = j
+    if count == 0:
+        total = pair
+        count = 2
+    if total == 0:
+        return([], 0, 0)
+    t16 = total * 16 // count
+    # Refine: T = sum(durations) / sum(multiples)
+    for _ in range(4):
+        limit = t16 * _MAX_UNITS // 16
+        total = 0
+        units = 0
+        for d in signal:
+            n = (d*16 + t16//2) // t16
+            if n and _MIN_UNIT_US <= d <= limit:
+                total += d
+                units += n
+        t = total * 16 // units
+        if t == t16:
+            break
+        t16 = t
+    base = (t16 + 8) // 16
+    limit = t16 * _MAX_UNITS // 16
+    calibrated = [0] * len(signal)
+    error = 0
+    count = 0
+    for i in range(len(signal)):
+        d = signal[i]
+        n = (d*16 + t16//2) // t16
+        if n < 1:
+            n = 1
+        calibrated[i] = n * base
+        if _MIN_UNIT_US <= d <= limit and d*16 >= t16//2:
+            error += abs(d*16 - n*t16)
+            count += 1
+    return(calibrated, base, error // (count*16))
+
 class UpyIrRx():
     # Default record stop condition
     WAIT_MS_DEFAULT  = const(5000)   # [ms]
     BLANK_MS_DEFAULT = const(200)    # [ms]
     MAX_DEFAULT      = const(1023)
-    # Binary bytes per sample
+    # Binary bytes per sample (ENCODE_24BIT)
     UNIT_BYTES = const(3)
 
+    # Sample encoding of the record buffer
+    ENCODE_24BIT = const(0)    # 3 bytes [us]
+    ENCODE_16BIT = const(1)    # 2 bytes [tick_us], 0xffff + 3 bytes [us] if longer
+    ENCODE_8BIT  = const(2)    # 1 byte [tick_us], 0xff + 3 bytes [us] if longer
+
     # Record mode
     MODE_STAND_BY  = const(0)    # stop recording
     MODE_DONE_OK   = const(1)
     MODE_DONE_NG   = const(2)
     MODE_READY     = const(3)    # run recording
     MODE_RECORDING = const(4)
+    MODE_LISTEN    = const(5)    # continuous recording
+
+    # Completed frames held by continuous recording
+    FRAME_QUEUE = const(8)
 
     # Error code
     ERROR_NONE        = const(0)
@@ -27,8 +127,12 @@ class UpyIrRx():
     ERROR_END_POINT   = const(4)
     ERROR_TIMEOUT     = const(5)
 
-    def __init__(self, pin, max_size=0, idle_level=1):
+    def __init__(self, pin, max_size=0, idle_level=1, timer_id=-1, encoding=0, tick_us=1, double_buffer=False):
+        if encoding < 0 or encoding > UpyIrRx.ENCODE_8BIT or tick_us < 1:
+            raise(ValueError())
         self._pin = pin
+        self._timer_id = timer_id
+        self._timer = None
         if max_size <= 0:
             self._max_size = UpyIrRx.MAX_DEFAULT
         else:
@@ -40,64 +144,254 @@ class UpyIrRx():
             self._idle_level = 1
         else:
             self._idle_level = 0
-        self._buffer = bytearray(self._max_size * UpyIrRx.UNIT_BYTES)
+        self._encoding = encoding
+        self._tick_us = tick_us
+        self._buffer = bytearray(self._max_size * _ENCODE_BYTES[encoding])
         self._record_size = 0
+        self._pos = 0
+        # Double buffer: the next frame is recorded into the other buffer
+        # while the application reads the last one.
+        if double_buffer:
+            self._spare = bytearray(len(self._buffer))
+        else:
+            self._spare = None
+        # Recorded frame read by the get_*() methods (see _publish)
+        self._out_mode = UpyIrRx.MODE_STAND_BY
+        self._out_error = UpyIrRx.ERROR_NONE
+        self._out_buffer = self._buffer
+        self._out_size = 0
+        self._out_glitches = 0
+        # Glitch filter: pulses shorter than _min_us are removed
+        self._min_us = 0
+        self._glitches = 0
+        self._prev_pos = 0
+        self._prev_last = 0
         self._mode = UpyIrRx.MODE_STAND_BY
         self._error = UpyIrRx.ERROR_NONE
         self._now = 0
         self._last = 0
         self._stop_size = 0
+        self._wait_ms = 0
+        self._blank_us = 0
+        self._start_us = 0
+        self._first_us = 0
+        self._blank_end = False
+        # Continuous recording: self._buffer is used as a ring buffer
+        self._head = 0
+        self._tail = 0
+        self._frame_start = 0
+        self._frame_size = 0
+        self._in_frame = False
+        self._dropped = False
+        self._lost = 0
+        self._ends = [0] * UpyIrRx.FRAME_QUEUE
+        self._ends_r = 0
+        self._ends_w = 0
+        self._attach()
+
+    def _attach(self):
+        # Edge capture by pin interrupt
+        # The timer detects the blank time after the last edge.
+        self._timer = Timer(self._timer_id)
+        self._timeout_cb = self._timeout
         dmy = self._pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self._callback)
 
     def get_mode(self):
+        if self._spare is not None:
+            return(self._out_mode)
         return(self._mode)
 
     def get_error_code(self):
+        if self._spare is not None:
+            return(self._out_error)
         return(self._error)
 
     def get_record_buffer(self):
-        if self._mode == UpyIrRx.MODE_DONE_OK:
-            return(self._buffer)
+        if self._out_mode == UpyIrRx.MODE_DONE_OK:
+            return(self._out_buffer)
         else:
             return(b'')
 
     def get_record_size(self):
-        if self._mode == UpyIrRx.MODE_DONE_OK:
-            return(self._record_size)
+        if self._out_mode == UpyIrRx.MODE_DONE_OK:
+            return(self._out_size)
         else:
             return(0)
 
+    def set_glitch_filter(self, min_us=0):
+        # Remove pulses shorter than min_us[us] (0: no filter)
+        self._min_us = min_us
+
+    def get_glitch_count(self):
+        # Number of pulses removed by the glitch filter in the last recording,
+        # or since listen() during continuous recording
+        if self._mode == UpyIrRx.MODE_LISTEN:
+            return(self._glitches)
+        return(self._out_glitches)
+
     def get_encode_bytes(self):
-        return(UpyIrRx.UNIT_BYTES)
+        # Bytes per sample (ENCODE_16BIT: 5 bytes, ENCODE_8BIT: 4 bytes for a long duration)
+        return(_ENCODE_BYTES[self._encoding])
 
-    def get_record_list(self):
-        if self._mode == UpyIrRx.MODE_DONE_OK:
-            return([int.from_bytes(self._buffer[i*UpyIrRx.UNIT_BYTES: (i+1)*UpyIrRx.UNIT_BYTES], 'little') for i in range(self._record_size)])
+    @micropython.native
+    def _put(self, pos, t, free):
+        # Write the duration t[us] at the byte position pos (wrapping around).
+        # Return the bytes written, or 0 if they exceed free.
+        # Called by the edge interrupt. Do not allocate heap memory here.
+        # An escaped duration is the 0xff marker bytes, then 3 bytes [us].
+        # They are written one by one, so no value exceeds a small int.
+        enc = self._encoding
+        if t > 0xffffff:
+            t = 0xffffff
+        mark = 0
+        if enc == _ENCODE_24BIT:
+            n = 3
         else:
-            return([])
+            tick = self._tick_us
+            v = (t + (tick >> 1)) // tick
+            if enc == _ENCODE_16BIT:
+                if v < _ESCAPE16:
+                    n = 2
+                    t = v
+                else:
+                    n = 5
+                    mark = 2
+            elif v < _ESCAPE:
+                n = 1
+                t = v
+            else:
+                n = 4
+                mark = 1
+        if n > free:
+            return(0)
+        buf = self._buffer
+        size = len(buf)
+        i = n
+        while i:
+            if mark:
+                buf[pos] = 0xff
+                mark -= 1
+            else:
+                buf[pos] = t & 0xff
+                t >>= 8
+            pos += 1
+            if pos >= size:
+                pos = 0
+            i -= 1
+        return(n)
 
-    def get_calibrate_list(self):
-        top32 = [9999]*32
-        for i in range(self._record_size if self._record_size < 32 else 32):
-            top32[i] = int.from_bytes(self._buffer[i*UpyIrRx.UNIT_BYTES: (i+1)*UpyIrRx.UNIT_BYTES], 'little')
-        min_interval = min(top32)
-        for i in range(31):
-            if top32[i] < min_interval*1.4 and top32[i+1] < min_interval*1.4:
-                basic_time = (top32[i]+top32[i+1]) // 2
+    def _append(self, t):
+        # Add the duration t[us] to the recorded samples. False if the buffer is full.
+        pos = self._pos
+        n = self._put(pos, t, len(self._buffer) - pos)
+        if n == 0 or self._record_size >= self._max_size:
+            return(False)
+        self._pos = pos + n
+        self._record_size += 1
+        return(True)
+
+    def _store(self, durations):
+        # Record the durations[us] measured by a peripheral, up to the blank time,
+        # with the glitch filter. Set the judgement and return the error code.
+        self._record_size = 0
+        self._pos = 0
+        carry = 0       # Glitch and the sample removed with it
+        lead = False    # Idle level after a glitch at the beginning
+        last_t = 0
+        last_pos = 0
+        for t in durations:
+            if lead:
+                lead = False
+                continue
+            t += carry
+            carry = 0
+            if t >= self._blank_us or self._record_size >= self._stop_size:
                 break
+            if t < self._min_us:
+                self._glitches += 1
+                if self._record_size == 0:
+                    lead = True
+                else:
+                    self._pos = last_pos
+                    self._record_size -= 1
+                    carry = last_t + t
+                continue
+            last_pos = self._pos
+            last_t = t
+            if not self._append(t):
+                self._record_size = 0
+                self._mode = UpyIrRx.MODE_DONE_NG
+                self._error = UpyIrRx.ERROR_OVERFLOW
+                return(self._error)
+        if self._record_size == 0:
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_NO_DATA
+        elif self._record_size % 2 == 0:
+            self._record_size = 0
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_END_POINT
+        else:
+            self._mode = UpyIrRx.MODE_DONE_OK
+        return(self._error)
+
+    def _read(self, buf, pos, end, count=-1):
+        # Decode the samples from the byte position pos to end (wrapping around),
+        # or count samples if count >= 0.
+        size = len(buf)
+        enc = self._encoding
+        tick = self._tick_us
+        signal = []
+        while pos != end and count != 0:
+            if enc == UpyIrRx.ENCODE_16BIT:
+                v = buf[pos] | (buf[(pos+1) % size] << 8)
+                escape = v == _ESCAPE16
+                pos += 2
+            elif enc == UpyIrRx.ENCODE_8BIT:
+                v = buf[pos]
+                escape = v == _ESCAPE
+                pos += 1
+            else:
+                escape = True
+            if escape:
+                t = buf[pos % size] | (buf[(pos+1) % size] << 8) | (buf[(pos+2) % size] << 16)
+                pos += 3
+            else:
+                t = v * tick
+            pos %= size
+            signal.append(t)
+            count -= 1
+        return(signal)
+
+    def _decode(self):
+        # Decode all recorded samples in one pass
+        buf = self._out_buffer
+        if self._encoding != UpyIrRx.ENCODE_24BIT:
+            return(self._read(buf, 0, -1, self._out_size))
+        return([buf[i] | (buf[i+1] << 8) | (buf[i+2] << 16) for i in range(0, self._out_size*UpyIrRx.UNIT_BYTES, UpyIrRx.UNIT_BYTES)])
+
+    def get_record_list(self):
+        if self._out_mode == UpyIrRx.MODE_DONE_OK:
+            return(self._decode())
         else:
             return([])
-        return([round(int.from_bytes(self._buffer[i*UpyIrRx.UNIT_BYTES: (i+1)*UpyIrRx.UNIT_BYTES], 'little')/basic_time)*basic_time for i in range(self._record_size)])
 
-    def record(self, wait_ms=0, blank_ms=0, stop_size=0):
+    def get_calibrate_list(self):
+        return(calibrate(self._decode())[0])
+
+    def get_calibrate_result(self):
+        # (calibrated list, base time[us], mean residual[us])
+        return(calibrate(self._decode()))
+
+    def _prepare(self, wait_ms, blank_ms, stop_size):
+        # Set the stop condition. Return False if the recording cannot begin.
         if wait_ms <= 0:
-            _wait_ms = UpyIrRx.WAIT_MS_DEFAULT
+            self._wait_ms = UpyIrRx.WAIT_MS_DEFAULT
         else:
-            _wait_ms = wait_ms
+            self._wait_ms = wait_ms
         if blank_ms <= 0:
-            _blank_us = UpyIrRx.BLANK_MS_DEFAULT*1000
+            self._blank_us = UpyIrRx.BLANK_MS_DEFAULT*1000
         else:
-            _blank_us = blank_ms*1000
+            self._blank_us = blank_ms*1000
         if stop_size <= 0:
             self._stop_size = self._max_size
         else:
@@ -108,16 +402,31 @@ class UpyIrRx():
             if self._stop_size > self._max_size:
                 self._stop_size = self._max_size
         self._record_size = 0
+        self._pos = 0
+        self._glitches = 0
         self._error = UpyIrRx.ERROR_NONE
         if self._pin.value() != self._idle_level:
             self._mode = UpyIrRx.MODE_DONE_NG
             self._error = UpyIrRx.ERROR_START_POINT
             self._record_size = 0
-            return(self._error)
-        # begin recording
+            return(False)
+        return(True)
+
+    def _begin(self):
+        self._blank_end = False
         self._mode = UpyIrRx.MODE_READY
-        _start_us = time.ticks_us()
-        time.sleep_ms(_wait_ms)
+        self._start_us = time.ticks_us()
+
+    def _is_waiting(self):
+        # Recording continues until the blank time passes after the last edge,
+        # the buffer stops it or wait_ms passes.
+        if self._mode != UpyIrRx.MODE_READY and (self._mode != UpyIrRx.MODE_RECORDING or self._blank_end):
+            return(False)
+        return(time.ticks_diff(time.ticks_us(), self._start_us) < self._wait_ms*1000)
+
+    def _finish(self):
+        if self._timer:
+            self._timer.deinit()
         # judgement
         if self._mode == UpyIrRx.MODE_DONE_NG:
             return(self._error)
@@ -129,16 +438,13 @@ class UpyIrRx():
             self._mode = UpyIrRx.MODE_DONE_NG
             self._error = UpyIrRx.ERROR_NO_DATA
             self._record_size = 0
-        elif time.ticks_diff(self._last, _start_us) + _blank_us > _wait_ms*1000:
+        elif time.ticks_diff(self._last, self._start_us) + self._blank_us > self._wait_ms*1000:
             # < self._mode == UpyIrRx.MODE_RECORDING >
             self._mode = UpyIrRx.MODE_DONE_NG
             self._error = UpyIrRx.ERROR_TIMEOUT
             self._record_size = 0
         else:
-            for i in range(self._record_size):
-                if int.from_bytes(self._buffer[i*UpyIrRx.UNIT_BYTES: (i+1)*UpyIrRx.UNIT_BYTES], 'little') >= _blank_us:
-                    self._record_size = i
-                    break
+            # Durations of the blank time or more are not recorded (see _callback)
             if self._record_size % 2 == 0:
                 self._mode = UpyIrRx.MODE_DONE_NG
                 self._error = UpyIrRx.ERROR_END_POINT
@@ -150,20 +456,229 @@ class UpyIrRx():
         # end critial
         return(self._error)
 
+    def _first_edge(self):
+        # ticks_us() of the first edge of a good recording
+        return(self._first_us)
+
+    def _resume(self):
+        # Double buffer: True if the next frame is already being recorded.
+        # The wait time starts again from now.
+        if self._spare is None:
+            return(False)
+        mode = self._mode
+        if mode != UpyIrRx.MODE_READY and mode != UpyIrRx.MODE_RECORDING and mode != UpyIrRx.MODE_DONE_OK:
+            return(False)
+        self._start_us = time.ticks_us()
+        return(True)
+
+    def _publish(self):
+        # Hand the recorded frame over to the get_*() methods.
+        # Double buffer: swap the buffers and begin recording the next frame.
+        self._out_mode = self._mode
+        self._out_error = self._error
+        self._out_buffer = self._buffer
+        self._out_size = self._record_size
+        self._out_glitches = self._glitches
+        if self._spare is not None and self._mode == UpyIrRx.MODE_DONE_OK:
+            self._buffer, self._spare = self._spare, self._buffer
+            if self._prepare(self._wait_ms, self._blank_us//1000, self._stop_size):
+                self._begin()
+        return(self._out_error)
+
+    def record(self, wait_ms=0, blank_ms=0, stop_size=0):
+        if not self._resume():
+            if not self._prepare(wait_ms, blank_ms, stop_size):
+                return(self._publish())
+            # begin recording
+            self._begin()
+        while self._is_waiting():
+            time.sleep_ms(1)
+        self._finish()
+        return(self._publish())
+
+    async def arecord(self, wait_ms=0, blank_ms=0, stop_size=0):
+        # Same as record(), but other tasks run while waiting for the signal
+        import uasyncio as asyncio
+        if not self._resume():
+            if not self._prepare(wait_ms, blank_ms, stop_size):
+                return(self._publish())
+            # begin recording
+            self._begin()
+        while self._is_waiting():
+            await asyncio.sleep_ms(1)
+        self._finish()
+        return(self._publish())
+
+    def listen(self, blank_ms=0):
+        # Begin continuous recording. Each signal separated by blank_ms is
+        # queued as a frame, and recording continues until stop().
+        if blank_ms <= 0:
+            self._blank_us = UpyIrRx.BLANK_MS_DEFAULT*1000
+        else:
+            self._blank_us = blank_ms*1000
+        irq_state = disable_irq()
+        self._head = 0
+        self._tail = 0
+        self._in_frame = False
+        self._ends_r = 0
+        self._ends_w = 0
+        self._lost = 0
+        self._glitches = 0
+        self._record_size = 0
+        self._error = UpyIrRx.ERROR_NONE
+        self._mode = UpyIrRx.MODE_LISTEN
+        enable_irq(irq_state)
+
+    def stop(self):
+        # End continuous recording. Queued frames can still be read.
+        self._mode = UpyIrRx.MODE_STAND_BY
+        if self._timer:
+            self._timer.deinit()
+
+    def get_lost_count(self):
+        # Number of frames discarded by continuous recording
+        # (ring buffer full, frame queue full, or not ending with idle_level)
+        return(self._lost)
+
+    def get_frame(self):
+        # Take out the oldest completed frame. Empty list if there is none.
+        if self._ends_r == self._ends_w:
+            return([])
+        end = self._ends[self._ends_r]
+        frame = self._read(self._buffer, self._tail, end)
+        self._tail = end
+        self._ends_r = (self._ends_r + 1) % UpyIrRx.FRAME_QUEUE
+        return(frame)
+
+    def frames(self, wait_ms=0):
+        # Generator of completed frames during continuous recording.
+        # Ends after wait_ms without a new frame (0: until stop()).
+        _start_ms = time.ticks_ms()
+        while True:
+            frame = self.get_frame()
+            if frame:
+                yield(frame)
+                _start_ms = time.ticks_ms()
+            elif self._mode != UpyIrRx.MODE_LISTEN:
+                return
+            elif wait_ms > 0 and time.ticks_diff(time.ticks_ms(), _start_ms) >= wait_ms:
+                return
+            else:
+                time.sleep_ms(1)
+
+    def _close_frame(self):
+        # Queue the frame being recorded, or discard it
+        self._in_frame = False
+        w = self._ends_w + 1
+        if w >= UpyIrRx.FRAME_QUEUE:
+            w = 0
+        if self._dropped or self._frame_size % 2 == 0 or w == self._ends_r:
+            self._lost += 1
+            self._head = self._frame_start
+            return
+        self._ends[self._ends_w] = self._head
+        self._ends_w = w
+
+    def _timeout(self, t):
+        # Timer callback: re-arm until the blank time passes after the last edge
+        mode = self._mode
+        if mode != _MODE_RECORDING and (mode != _MODE_LISTEN or not self._in_frame):
+            return
+        rest = self._blank_us - ticks_diff(ticks_us(), self._last)
+        if rest > 0:
+            t.init(mode=Timer.ONE_SHOT, period=rest//1000 + 1, callback=self._timeout_cb)
+        elif mode == _MODE_LISTEN:
+            self._close_frame()
+        else:
+            self._blank_end = True
+
+    @micropython.native
     def _callback(self, p):
-        if self._mode == UpyIrRx.MODE_READY:
-            self._last = time.ticks_us()
-            self._mode = UpyIrRx.MODE_RECORDING
-        elif self._mode == UpyIrRx.MODE_RECORDING:
-            self._now = time.ticks_us()
-            if self._record_size >= self._max_size:
-                self._mode = UpyIrRx.MODE_DONE_NG
-                self._error = UpyIrRx.ERROR_OVERFLOW
+        # Called on every edge. Do not allocate heap memory here.
+        now = ticks_us()
+        mode = self._mode
+        if mode == _MODE_RECORDING:
+            size = self._record_size
+            if size >= self._max_size:
+                self._mode = _MODE_DONE_NG
+                self._error = _ERROR_OVERFLOW
                 self._record_size = 0
                 return
-            self._buffer[self._record_size*UpyIrRx.UNIT_BYTES: (self._record_size+1)*UpyIrRx.UNIT_BYTES] = time.ticks_diff(self._now, self._last).to_bytes(UpyIrRx.UNIT_BYTES, 'little')
-            self._last = self._now
-            self._record_size += 1
-            if self._record_size >= self._stop_size:
-                self._mode = UpyIrRx.MODE_DONE_OK
-                self._error = UpyIrRx.ERROR_NONE
+            diff = ticks_diff(now, self._last)
+            if diff >= self._blank_us:
+                # The blank time has passed. The recording ends at the last edge.
+                self._blank_end = True
+                return
+            if diff < self._min_us:
+                # Glitch: remove it with the sample before it
+                self._glitches += 1
+                if size == 0:
+                    self._mode = _MODE_READY
+                else:
+                    self._pos = self._prev_pos
+                    self._last = self._prev_last
+                    self._record_size = size - 1
+                return
+            pos = self._pos
+            n = self._put(pos, diff, len(self._buffer) - pos)
+            if n == 0:
+                self._mode = _MODE_DONE_NG
+                self._error = _ERROR_OVERFLOW
+                self._record_size = 0
+                return
+            self._pos = pos + n
+            self._prev_pos = pos
+            self._prev_last = self._last
+            self._last = now
+            size += 1
+            self._record_size = size
+            if size >= self._stop_size:
+                self._mode = _MODE_DONE_OK
+                self._error = _ERROR_NONE
+        elif mode == _MODE_READY:
+            self._last = now
+            self._first_us = now
+            self._mode = _MODE_RECORDING
+            self._timer.init(mode=Timer.ONE_SHOT, period=self._blank_us//1000, callback=self._timeout_cb)
+        elif mode == _MODE_LISTEN:
+            if self._in_frame:
+                diff = ticks_diff(now, self._last)
+                if diff < self._blank_us:
+                    if diff < self._min_us:
+                        # Glitch: remove it with the sample before it
+                        self._glitches += 1
+                        if self._frame_size == 0:
+                            self._in_frame = False
+                        else:
+                            self._head = self._prev_pos
+                            self._last = self._prev_last
+                            self._frame_size -= 1
+                        return
+                    if not self._dropped:
+                        head = self._head
+                        size = len(self._buffer)
+                        free = self._tail - head - 1
+                        if free < 0:
+                            free += size
+                        n = self._put(head, diff, free)
+                        if n == 0:
+                            # Ring buffer full: this frame is discarded
+                            self._dropped = True
+                        else:
+                            head += n
+                            if head >= size:
+                                head -= size
+                            self._prev_pos = self._head
+                            self._prev_last = self._last
+                            self._head = head
+                            self._frame_size += 1
+                    self._last = now
+                    return
+                # The timer has not closed the last frame yet
+                self._close_frame()
+            self._in_frame = True
+            self._dropped = False
+            self._frame_start = self._head
+            self._frame_size = 0
+            self._last = now
+            self._timer.init(mode=Timer.ONE_SHOT, period=self._blank_us//1000, callback=self._timeout_cb)
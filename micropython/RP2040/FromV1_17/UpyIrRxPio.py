@@ -0,0 +1,167 @@
+from rp2 import PIO, asm_pio, StateMachine
+from machine import mem32
+from micropython import const
+from array import array
+import time
+from UpyIrRx import UpyIrRx
+try:
+    from rp2 import DMA    # micropython v1.21 or later
+except ImportError:
+    DMA = None
+
+# IR RX class for RaspberryPi pico
+# The PIO measures the time between edges, so the interpreter
+# latency does not affect the recorded durations.
+
+_SM_FREQ = const(10000000)     # 0.1us per cycle
+_CYCLES_US = const(10)         # State machine cycles per 1us
+_EDGE_CYCLES = const(5)        # Fixed cycles per edge (see pio_edge)
+_PIO0_RXF = const(0x50200020)  # RXF0 register of PIO0
+_PIO1_RXF = const(0x50300020)  # RXF0 register of PIO1
+_PIO0_FDEBUG = const(0x50200008)
+_PIO1_FDEBUG = const(0x50300008)
+# RXSTALL bit of FDEBUG is also set when push(noblock) drops a count on a full FIFO
+_DREQ_PIO0_RX = const(4)
+_DREQ_PIO1_RX = const(12)
+
+@asm_pio(fifo_join=PIO.JOIN_RX)
+def pio_edge():
+    # Count 2 cycle loops while the level is unchanged, push the count at
+    # each edge. Both paths take _EDGE_CYCLES outside the loops.
+    wrap_target()
+    mov(x, invert(null))
+    label('high_loop')
+    jmp(pin, 'high_next')
+    jmp('high_done')
+    label('high_next')
+    jmp(x_dec, 'high_loop')
+    label('high_done')
+    mov(isr, invert(x))
+    push(noblock)
+    mov(x, invert(null))
+    label('low_loop')
+    jmp(pin, 'low_done')
+    jmp(x_dec, 'low_loop')
+    label('low_done')
+    mov(isr, invert(x))[1]
+    push(noblock)
+    wrap()
+
+class UpyIrRxPio(UpyIrRx):
+
+    def __init__(self, ch, pin, max_size=0, idle_level=1, encoding=0, tick_us=1):
+        self._sm = None
+        self._dma = None
+        if ch < 0 or ch > 7:
+            raise(IndexError())
+        self._ch = ch
+        self._fdebug = _PIO0_FDEBUG if ch < 4 else _PIO1_FDEBUG
+        self._rxstall = 1 << (ch % 4)
+        super().__init__(pin, max_size, idle_level, encoding=encoding, tick_us=tick_us)
+
+    def __del__(self):
+        if self._sm:
+            self._sm.active(0)
+        if self._dma:
+            self._dma.close()
+
+    def _attach(self):
+        # The first count is the idle time before the first edge.
+        # If idle_level is 0, a zero count comes before it.
+        self._skip = 1 if self._idle_level else 2
+        self._words = array('I', [0] * (self._max_size + self._skip + 1))
+        self._sm = StateMachine(self._ch, pio_edge, freq=_SM_FREQ, jmp_pin=self._pin)
+        if DMA:
+            self._dma = DMA()
+            if self._ch < 4:
+                self._rxf = _PIO0_RXF + self._ch*4
+                self._dreq = _DREQ_PIO0_RX + self._ch
+            else:
+                self._rxf = _PIO1_RXF + (self._ch-4)*4
+                self._dreq = _DREQ_PIO1_RX + self._ch - 4
+
+    def _begin(self):
+        self._mode = UpyIrRx.MODE_READY
+        self._count = 0
+        self._polled = 0
+        # init() also clears the FIFO and restarts the program
+        self._sm.init(pio_edge, freq=_SM_FREQ, jmp_pin=self._pin)
+        mem32[self._fdebug] = self._rxstall    # Write 1 to clear
+        if self._dma:
+            ctrl = self._dma.pack_ctrl(size=2, inc_read=False, treq_sel=self._dreq)
+            self._dma.config(read=self._rxf, write=self._words, count=len(self._words), ctrl=ctrl, trigger=True)
+        self._sm.active(1)
+        self._start_us = time.ticks_us()
+        self._start_ms = self._last_ms = time.ticks_ms()
+
+    def _received(self):
+        if self._dma:
+            return(len(self._words) - self._dma.count)
+        # Without DMA, drain the FIFO (8 words) by polling
+        sm = self._sm
+        words = self._words
+        count = self._polled
+        while sm.rx_fifo() and count < len(words):
+            words[count] = sm.get()
+            count += 1
+        self._polled = count
+        return(count)
+
+    def _dropped(self):
+        # True if a count has been lost on a full FIFO drained by polling.
+        # DMA keeps the FIFO empty until the word array is full.
+        if self._dma:
+            return(False)
+        return(mem32[self._fdebug] & self._rxstall != 0)
+
+    def _is_waiting(self):
+        now = time.ticks_ms()
+        n = self._received()
+        if self._dropped():
+            return(False)
+        if n != self._count:
+            self._count = n
+            self._last_ms = now
+            if n >= self._skip:
+                self._mode = UpyIrRx.MODE_RECORDING
+        if n >= self._stop_size + self._skip or n >= len(self._words):
+            return(False)
+        if self._mode == UpyIrRx.MODE_RECORDING and time.ticks_diff(now, self._last_ms)*1000 >= self._blank_us:
+            return(False)
+        return(time.ticks_diff(now, self._start_ms) < self._wait_ms)
+
+    def _first_edge(self):
+        # The count before the first edge is the idle time from the start
+        idle = (self._words[self._skip-1]*2 + _EDGE_CYCLES + _CYCLES_US//2) // _CYCLES_US
+        return(time.ticks_add(self._start_us, idle))
+
+    def _finish(self):
+        self._sm.active(0)
+        if self._dma:
+            self._dma.active(0)
+        skip = self._skip
+        count = self._count
+        # judgement
+        if self._mode == UpyIrRx.MODE_READY:
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_NO_DATA
+            return(self._error)
+        if self._dropped():
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_OVERFLOW
+            return(self._error)
+        if count >= self._stop_size + skip:
+            size = self._stop_size
+        elif count >= len(self._words):
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_OVERFLOW
+            return(self._error)
+        elif time.ticks_diff(self._last_ms, self._start_ms)*1000 + self._blank_us > self._wait_ms*1000:
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_TIMEOUT
+            return(self._error)
+        else:
+            size = count - skip
+        # loop counts -> [us]
+        words = self._words
+        return(self._store((words[i+skip]*2 + _EDGE_CYCLES + _CYCLES_US//2) // _CYCLES_US for i in range(size)))
@@ -0,0 +1,69 @@
+from machine import Pin, disable_irq, enable_irq
+import micropython
+import time
+from time import ticks_us, ticks_diff
+from array import array
+from UpyIrRx import UpyIrRx
+
+# IR RX class for ESP32 & RaspberryPi pico
+# The edge interrupt only stores ticks_us() in a word array.
+# The durations, wraparound and blank time are worked out in one pass
+# after the recording, so a higher edge rate can be recorded.
+
+class UpyIrRxStamp(UpyIrRx):
+
+    def __init__(self, pin, max_size=0, idle_level=1, encoding=0, tick_us=1, double_buffer=False):
+        super().__init__(pin, max_size, idle_level, encoding=encoding, tick_us=tick_us, double_buffer=double_buffer)
+
+    def _attach(self):
+        # n edges give n-1 durations
+        self._stamps = array('I', [0] * (self._max_size + 1))
+        self._count = 0
+        self._limit = 0
+        dmy = self._pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self._stamp, hard=True)
+
+    @micropython.native
+    def _stamp(self, p):
+        # Called on every edge. Do not allocate heap memory here.
+        n = self._count
+        if n < self._limit:
+            self._stamps[n] = ticks_us()
+            self._count = n + 1
+
+    def _begin(self):
+        irq_state = disable_irq()
+        self._count = 0
+        self._limit = self._stop_size + 1
+        enable_irq(irq_state)
+        self._mode = UpyIrRx.MODE_READY
+        self._start_us = time.ticks_us()
+
+    def _is_waiting(self):
+        now = time.ticks_us()
+        n = self._count
+        if n:
+            self._mode = UpyIrRx.MODE_RECORDING
+            if n >= self._limit or ticks_diff(now, self._stamps[n-1]) >= self._blank_us:
+                return(False)
+        return(ticks_diff(now, self._start_us) < self._wait_ms*1000)
+
+    def _first_edge(self):
+        return(self._stamps[0])
+
+    def _finish(self):
+        irq_state = disable_irq()
+        self._limit = 0
+        enable_irq(irq_state)
+        stamps = self._stamps
+        count = self._count
+        # judgement
+        if count == 0:
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_NO_DATA
+            return(self._error)
+        if count <= self._stop_size and ticks_diff(stamps[count-1], self._start_us) + self._blank_us > self._wait_ms*1000:
+            self._mode = UpyIrRx.MODE_DONE_NG
+            self._error = UpyIrRx.ERROR_TIMEOUT
+            return(self._error)
+        # time stamps -> [us]
+        return(self._store(ticks_diff(stamps[i], stamps[i-1]) for i in range(1, count)))
@@ -1,61 +1,298 @@
 from rp2 import PIO, asm_pio, StateMachine
+from machine import mem32
 from micropython import const
+from array import array
+import time
+try:
+    from rp2 import DMA    # micropython v1.21 or later
+except ImportError:
+    DMA = None
 
 # IR TX class for RaspberryPi pico
 # micropython v1.17 - v1.18(latest as of 2022/5)
+# From micropython v1.21, the durations are sent to the state machine by DMA.
 
-@asm_pio(autopull=True, pull_thresh=32, sideset_init=PIO.OUT_LOW)
-def pio_wave():
-    T = const(26)      # Period: 1/38kHz*1M [us]
-    OF_TIM = const(18) # Duty(30%) off time [us]
-    OF_POR = const(0)  # Idle level
-    ON_TIM = const(8)  # Duty(30%) on time [us]
-    ON_POR = const(1)  # not Idle level
-    wrap_target()
-    out(x, 32).side(OF_POR)
-    label('on')
-    set(y, ON_TIM).side(ON_POR)
-    label('on_loop')
-    jmp(x_dec, 'mid1').side(ON_POR)
-    label('mid1')
-    jmp(not_x, 'of').side(ON_POR)
-    jmp(y_dec, 'on_loop').side(ON_POR)
-    set(y, OF_TIM).side(OF_POR)
-    label('of_loop')
-    jmp(x_dec, 'mid2').side(OF_POR)
-    label('mid2')
-    jmp(not_x, 'of').side(OF_POR)
-    jmp(y_dec, 'of_loop').side(OF_POR)
-    jmp('on').side(OF_POR)
-    label('of')
-    out(x, 32).side(OF_POR)
-    label('stay')
-    jmp(x_dec, 'stay').side(OF_POR)[2]
-    wrap()
+_PIO0_BASE = const(0x50200000)
+_PIO1_BASE = const(0x50300000)
+_PIO0_TXF = const(0x50200010)  # TXF0 register of PIO0
+_PIO1_TXF = const(0x50300010)  # TXF0 register of PIO1
+_SM0_ADDR = const(0x0d4)       # Program counter of SM0
+_SM0_INSTR = const(0x0d8)      # Instruction executed at once
+_SM_STRIDE = const(0x18)
+_OF_LABEL = const(10)          # Address of 'of' in pio_wave()
+_FIFO_DEPTH = const(8)         # Joined TX FIFO
+_DREQ_PIO0_TX = const(0)
+_DREQ_PIO1_TX = const(8)
+_LAST_IDLE = const(100)        # Last idle level [us]
+_SM_FREQ = const(3000000)      # Default state machine clock: 1 loop (3 cycles) per 1us
+_LOOP_CYCLES = const(3)
+_TIM_MAX = const(31)           # 5bit immediate of set()
+
+# Assembled programs: {(ON_TIM, OF_TIM, idle_level): program}
+# StateMachine.init() does not load a program again while it is in the PIO memory.
+_programs = {}
+# Programs loaded by UpyIrTx in each PIO: {(PIO number, id(program)): [program, objects running it]}
+# When the PIO memory is full, only the programs that no object runs are removed.
+_loaded = {}
+
+def pio_wave(on_tim, of_tim, idle_level=0):
+    # Carrier of (on_tim + 1) loops on and (of_tim + 1) loops + 1 loop off.
+    # x counts the loops of the duration.
+    key = (on_tim, of_tim, idle_level)
+    if key in _programs:
+        return(_programs[key])
+    on_por = idle_level ^ 1
+    of_por = idle_level
+
+    @asm_pio(autopull=True, pull_thresh=32, sideset_init=(PIO.OUT_HIGH if idle_level else PIO.OUT_LOW), fifo_join=PIO.JOIN_TX)
+    def _wave():
+        wrap_target()
+        out(x, 32).side(of_por)
+        label('on')
+        set(y, on_tim).side(on_por)
+        label('on_loop')
+        jmp(x_dec, 'mid1').side(on_por)
+        label('mid1')
+        jmp(not_x, 'of').side(on_por)
+        jmp(y_dec, 'on_loop').side(on_por)
+        set(y, of_tim).side(of_por)
+        label('of_loop')
+        jmp(x_dec, 'mid2').side(of_por)
+        label('mid2')
+        jmp(not_x, 'of').side(of_por)
+        jmp(y_dec, 'of_loop').side(of_por)
+        jmp('on').side(of_por)
+        label('of')
+        out(x, 32).side(of_por)
+        label('stay')
+        jmp(x_dec, 'stay').side(of_por)[2]
+        wrap()
+
+    _programs[key] = _wave
+    return(_wave)
 
 class UpyIrTx():
 
-    # Fixed: (freq=38000, duty=30, idle_level=0)
-    def __init__(self, ch, pin, *args, **kwargs):
+    def __init__(self, ch, pin, freq=38000, duty=30, idle_level=0, sm_freq=_SM_FREQ):
         self._sm = None
+        self._dma = None
+        self._prog = None
         if ch < 0 or ch > 7:
             raise(IndexError())
-        self._sm = StateMachine(ch, pio_wave, freq=3000000, sideset_base=pin)
-        self._sm.active(1)
+        self._ch = ch
+        self._pin = pin
+        self._idle_level = 1 if idle_level else 0
+        self._sm_freq = sm_freq
+        self._words = None
+        self._sm = StateMachine(ch)
+        self.set_carrier(freq, duty)
+        if DMA:
+            self._dma = DMA()
+            if ch < 4:
+                self._txf = _PIO0_TXF + ch*4
+                self._dreq = _DREQ_PIO0_TX + ch
+            else:
+                self._txf = _PIO1_TXF + (ch-4)*4
+                self._dreq = _DREQ_PIO1_TX + ch - 4
 
     def __del__(self):
         if self._sm:
             self._sm.active(0)
+        self._release()
+        if self._dma:
+            self._dma.close()
+
+    def _release(self):
+        # The state machine no longer runs its program. The program stays in the PIO memory.
+        if self._prog is not None:
+            _loaded[(self._ch // 4, id(self._prog))][1] -= 1
+            self._prog = None
+
+    def set_carrier(self, freq, duty):
+        # Change the carrier between transmissions.
+        # 30 - 60kHz with the default sm_freq. A higher sm_freq gives a finer step.
+        if freq <= 0 or duty <= 0 or duty >= 100:
+            raise(IndexError())
+        period = (self._sm_freq // _LOOP_CYCLES + freq//2) // freq    # [loops]
+        on = (period*duty + 50) // 100
+        on_tim = on - 1
+        of_tim = period - on - 2
+        if on_tim < 0 or of_tim < 0 or on_tim > _TIM_MAX or of_tim > _TIM_MAX:
+            raise(ValueError())
+        prog = pio_wave(on_tim, of_tim, self._idle_level)
+        if self._prog is not None:
+            while not self.is_done():
+                time.sleep_ms(1)
+        self._sm.active(0)
+        self._release()
+        pio = self._ch // 4
+        try:
+            self._sm.init(prog, freq=self._sm_freq, sideset_base=self._pin)
+        except OSError:
+            # The PIO memory is full: remove the programs that no object runs
+            for key in [k for k in _loaded if k[0] == pio and _loaded[k][1] == 0]:
+                PIO(pio).remove_program(_loaded.pop(key)[0])
+            self._sm.init(prog, freq=self._sm_freq, sideset_base=self._pin)
+        key = (pio, id(prog))
+        if key not in _loaded:
+            _loaded[key] = [prog, 0]
+        _loaded[key][1] += 1
+        self._prog = prog
+        self._sm.active(1)
+        # [us] -> loops. x is not decremented by the one loop of each period
+        # outside the on/off loops, so the on durations are scaled by (period-1)/period.
+        self._of_num = self._sm_freq // 1000
+        self._of_den = _LOOP_CYCLES * 1000
+        self._on_num = self._of_num * (period - 1)
+        self._on_den = self._of_den * period
+
+    def _loops(self, signal_tuple):
+        # Durations [us] -> loop counts of the state machine
+        on_num = self._on_num
+        on_den = self._on_den
+        of_num = self._of_num
+        of_den = self._of_den
+        loops = [0] * len(signal_tuple)
+        for i in range(len(signal_tuple)):
+            if i % 2:
+                loops[i] = (signal_tuple[i]*of_num + of_den//2) // of_den
+            else:
+                loops[i] = (signal_tuple[i]*on_num + on_den//2) // on_den
+        loops.append(self._space(_LAST_IDLE))
+        return(loops)
+
+    def _space(self, d):
+        return((d*self._of_num + self._of_den//2) // self._of_den)
+
+    def start(self, signal_tuple):
+        # Begin the transmission by DMA and return at once (micropython v1.21 or later).
+        # Use is_done() to know the end of the transmission.
+        if not self._dma or (signal_tuple and isinstance(signal_tuple[0], (tuple, list))):
+            return(self.send(signal_tuple))
+        if not signal_tuple:
+            return(True)
+        if len(signal_tuple) % 2 == 0 or not self.is_done():
+            return(False)
+        self._start_dma(self._loops(signal_tuple))
+        return(True)
+
+    def _start_dma(self, loops):
+        # The buffer is reused while it is large enough
+        n = len(loops)
+        if self._words is None or len(self._words) < n:
+            self._words = array('I', loops)
+        else:
+            words = self._words
+            for i in range(n):
+                words[i] = loops[i]
+        ctrl = self._dma.pack_ctrl(size=2, inc_write=False, treq_sel=self._dreq)
+        self._dma.config(read=self._words, write=self._txf, count=n, ctrl=ctrl, trigger=True)
+
+    def _load(self, signal_tuple, offset_us=0):
+        # Stop the state machine and fill the FIFO for a start by the CTRL register of the PIO.
+        # The state machine must be waiting for the first duration (the last one has been sent).
+        # A phase offset is an idle level before the signal: the state machine jumps
+        # to 'of' and takes it as the first space.
+        # Return the loops left for the FIFO (none with DMA).
+        loops = self._loops(signal_tuple)
+        self._sm.active(0)
+        self._sm.restart()
+        if offset_us > 0:
+            sm = (_PIO0_BASE if self._ch < 4 else _PIO1_BASE) + _SM_STRIDE*(self._ch % 4)
+            pc = mem32[sm + _SM0_ADDR]
+            mem32[sm + _SM0_INSTR] = (self._idle_level << 12) | (pc + _OF_LABEL)    # jmp('of').side(of_por)
+            loops.insert(0, self._space(offset_us))
+        if self._dma:
+            self._start_dma(loops)
+            return([])
+        n = min(len(loops), _FIFO_DEPTH)
+        for i in range(n):
+            self._sm.put(loops[i])
+        return(loops[n:])
+
+    def is_done(self):
+        # True when the transmission has ended.
+        # The state machine has taken the last idle level when the FIFO is empty.
+        if self._dma and self._dma.active():
+            return(False)
+        return(self._sm.tx_fifo() == 0)
 
     def send(self, signal_tuple):
         # Blocking until transmission
         if not signal_tuple:
             return(True)
+        if isinstance(signal_tuple[0], (tuple, list)):
+            return(self._send_segments(signal_tuple))
         if len(signal_tuple) % 2 == 0:
             return(False)
-        for i in signal_tuple:
+        if self._dma:
+            while not self.is_done():
+                time.sleep_ms(1)
+            self.start(signal_tuple)
+            while not self.is_done():
+                time.sleep_ms(1)
+            return(True)
+        for i in self._loops(signal_tuple):
+            self._sm.put(i)
+        return(True)
+
+    def _check_segments(self, segments):
+        # [(frame, gap, count), ...] of UpyIrProtocol.compress()
+        for frame, gap, count in segments:
+            if len(frame) % 2 == 0 or count < 1:
+                return(False)
+        return(True)
+
+    def _segment_loops(self, segments):
+        # Loop counts of the segments, repeated without expanding them
+        last = len(segments) - 1
+        for j in range(len(segments)):
+            frame, gap, count = segments[j]
+            # The gap follows the frame instead of the last idle level
+            loops = self._loops(frame)
+            loops[-1] = self._space(gap)
+            for i in range(count):
+                if j == last and i == count - 1:
+                    loops[-1] = self._space(_LAST_IDLE)
+                yield from loops
+
+    def _send_segments(self, segments):
+        if not self._check_segments(segments):
+            return(False)
+        while not self.is_done():
+            time.sleep_ms(1)
+        for d in self._segment_loops(segments):
+            self._sm.put(d)
+        return(True)
+
+    async def asend(self, signal_tuple):
+        # Same as send(), but other tasks run during the transmission.
+        # The segments of compress() are put to the FIFO as in send().
+        # Without DMA, other tasks must not block longer than the queued durations.
+        import uasyncio as asyncio
+        if not signal_tuple:
+            return(True)
+        if isinstance(signal_tuple[0], (tuple, list)):
+            if not self._check_segments(signal_tuple):
+                return(False)
+            while not self.is_done():
+                await asyncio.sleep_ms(1)
+            loops = self._segment_loops(signal_tuple)
+        elif len(signal_tuple) % 2 == 0:
+            return(False)
+        elif self._dma:
+            while not self.is_done():
+                await asyncio.sleep_ms(1)
+            self.start(signal_tuple)
+            while not self.is_done():
+                await asyncio.sleep_ms(1)
+            return(True)
+        else:
+            loops = self._loops(signal_tuple)
+        for i in loops:
+            while self._sm.tx_fifo() >= 4:
+                await asyncio.sleep_ms(0)
             self._sm.put(i)
-        self._sm.put(100)  # Last idle level 100us
         return(True)
 
     def send_cls(self, ir_rx):
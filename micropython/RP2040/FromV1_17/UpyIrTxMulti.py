@@ -0,0 +1,100 @@
+from machine import mem32
+from micropython import const
+import time
+
+# Sends on several transmitters at once (RaspberryPi pico)
+# The transmitters are UpyIrTx objects on different state machines.
+# The FIFOs are filled first, and the state machines of each PIO are enabled
+# together by one write to its CTRL register, with their clock dividers in phase.
+
+_PIO0_CTRL = const(0x50200000)
+_PIO1_CTRL = const(0x50300000)
+_ATOMIC_SET = const(0x2000)    # Alias of the register to set bits
+_FIFO_DEPTH = const(8)
+
+class UpyIrTxMulti():
+
+    def __init__(self, transmitters):
+        if not transmitters:
+            raise(IndexError())
+        self._transmitters = list(transmitters)
+        # Without DMA, the FIFOs are filled without sleeping
+        self._poll_ms = 1
+        for tx in self._transmitters:
+            if tx._dma is None:
+                self._poll_ms = 0
+
+    def get_transmitter(self, index):
+        return(self._transmitters[index])
+
+    def _begin(self, signals, offsets_us):
+        # Load the transmitters and start them. Return [(tx, loops left for the FIFO), ...]
+        if len(signals) != len(self._transmitters):
+            return(None)
+        if offsets_us is None:
+            offsets_us = [0] * len(signals)
+        for signal in signals:
+            if signal is not None and (not signal or len(signal) % 2 == 0 or isinstance(signal[0], (tuple, list))):
+                return(None)
+        active = []
+        masks = [0, 0]
+        for i in range(len(signals)):
+            if signals[i] is not None:
+                tx = self._transmitters[i]
+                active.append((tx, tx._load(signals[i], offsets_us[i])))
+                masks[tx._ch // 4] |= 1 << (tx._ch % 4)
+        # SM_ENABLE and CLKDIV_RESTART
+        if masks[0]:
+            mem32[_PIO0_CTRL + _ATOMIC_SET] = masks[0] | (masks[0] << 8)
+        if masks[1]:
+            mem32[_PIO1_CTRL + _ATOMIC_SET] = masks[1] | (masks[1] << 8)
+        return(active)
+
+    def _is_sending(self, active):
+        # Fill the FIFOs without DMA. False when all have been sent.
+        sending = False
+        for tx, loops in active:
+            while loops and tx._sm.tx_fifo() < _FIFO_DEPTH:
+                tx._sm.put(loops.pop(0))
+            if loops or not tx.is_done():
+                sending = True
+        return(sending)
+
+    def _is_busy(self):
+        for tx in self._transmitters:
+            if not tx.is_done():
+                return(True)
+        return(False)
+
+    def send(self, signals, offsets_us=None):
+        # Blocking until transmission
+        # signals: the durations of each transmitter, None for no transmission.
+        # offsets_us: the idle time of each transmitter before its signal [us].
+        while self._is_busy():
+            time.sleep_ms(1)
+        # The last idle level of the state machines
+        time.sleep_ms(1)
+        active = self._begin(signals, offsets_us)
+        if active is None:
+            return(False)
+        while self._is_sending(active):
+            time.sleep_ms(self._poll_ms)
+        return(True)
+
+    def send_all(self, signal_tuple, offsets_us=None):
+        # The same signal on every transmitter
+        return(self.send([signal_tuple] * len(self._transmitters), offsets_us))
+
+    async def asend(self, signals, offsets_us=None):
+        # Same as send(), but other tasks run during the transmission.
+        # Without DMA, other tasks must not block longer than the queued durations.
+        import uasyncio as asyncio
+        while self._is_busy():
+            await asyncio.sleep_ms(1)
+        await asyncio.sleep_ms(1)
+        active = self._begin(signals, offsets_us)
+        if active is None:
+            return(False)
+        while self._is_sending(active):
+            await asyncio.sleep_ms(self._poll_ms)
+        return(True)
@@ -0,0 +1,111 @@
+import time
+
+# Transmit queue for ESP32 & RaspberryPi pico
+# Each entry is a signal, the number of frames, the gap between the frames,
+# a priority, a start time and a deadline. run() sends the entries when they
+# are due, the higher priority first. The frames of an entry are sent in one
+# transmission of UpyIrTx, so the gaps are exact.
+
+class UpyIrTxQueue():
+
+    RESULT_OK = 0
+    RESULT_NG = 1      # UpyIrTx.send() failed
+    RESULT_LATE = 2    # The deadline passed before the entry was due
+
+    def __init__(self, ir_tx, size=16):
+        self._tx = ir_tx
+        self._size = size
+        self._entries = []
+        self._id = 0
+
+    def __len__(self):
+        return(len(self._entries))
+
+    def put(self, signal_tuple, count=1, gap=0, priority=0, start_ms=0, deadline_ms=0):
+        # Queue the signal sent count times with gap[us] between the frames.
+        # start_ms and deadline_ms are from now, and deadline_ms=0 is none.
+        # Return the id of the entry, or -1 if it is not queued.
+        if not signal_tuple or len(signal_tuple) % 2 == 0 or count < 1:
+            return(-1)
+        if (count > 1 and gap <= 0) or len(self._entries) >= self._size:
+            return(-1)
+        if deadline_ms and deadline_ms < start_ms:
+            return(-1)
+        now = time.ticks_ms()
+        deadline = time.ticks_add(now, deadline_ms) if deadline_ms else None
+        self._id += 1
+        self._entries.append((self._id, signal_tuple, count, gap, priority, time.ticks_add(now, start_ms), deadline))
+        return(self._id)
+
+    def clear(self):
+        self._entries = []
+
+    def _due_ms(self):
+        # Time until the first entry is due [ms], 0 if any is due
+        now = time.ticks_ms()
+        wait = None
+        for entry in self._entries:
+            diff = time.ticks_diff(entry[5], now)
+            if wait is None or diff < wait:
+                wait = diff
+        return(max(wait, 0))
+
+    def _pop(self):
+        # The due entry of the highest priority, the earliest start, then the first queued
+        now = time.ticks_ms()
+        best = None
+        for entry in self._entries:
+            if time.ticks_diff(now, entry[5]) < 0:
+                continue
+            if best is None or entry[4] > best[4] or (entry[4] == best[4] and time.ticks_diff(entry[5], best[5]) < 0):
+                best = entry
+        self._entries.remove(best)
+        return(best)
+
+    def _next(self):
+        # (id, signal to send) of the due entry. The signal is None when the entry is late.
+        entry_id, signal, count, gap, priority, start, deadline = self._pop()
+        if deadline is not None and time.ticks_diff(time.ticks_ms(), deadline) > 0:
+            return((entry_id, None))
+        if count > 1:
+            signal = [(signal, gap, count)]
+        return((entry_id, signal))
+
+    def _send(self):
+        entry_id, signal = self._next()
+        if signal is None:
+            return((entry_id, UpyIrTxQueue.RESULT_LATE))
+        if self._tx.send(signal):
+            return((entry_id, UpyIrTxQueue.RESULT_OK))
+        return((entry_id, UpyIrTxQueue.RESULT_NG))
+
+    def run(self):
+        # Blocking until the queue is empty. Return [(id, result), ...] in the sent order.
+        results = []
+        while self._entries:
+            wait = self._due_ms()
+            if wait:
+                time.sleep_ms(wait)
+            else:
+                results.append(self._send())
+        return(results)
+
+    async def arun(self):
+        # Same as run(), but other tasks run while waiting for the entries
+        # and during the transmissions. Entries put by the other tasks are also sent.
+        import uasyncio as asyncio
+        results = []
+        while self._entries:
+            wait = self._due_ms()
+            if wait:
+                await asyncio.sleep_ms(min(wait, 10))
+            else:
+                entry_id, signal = self._next()
+                if signal is None:
+                    results.append((entry_id, UpyIrTxQueue.RESULT_LATE))
+                elif await self._tx.asend(signal):
+                    results.append((entry_id, UpyIrTxQueue.RESULT_OK))
+                else:
+                    results.append((entry_id, UpyIrTxQueue.RESULT_NG))
+                await asyncio.sleep_ms(0)
+        return(results)